@@ -2,6 +2,7 @@ from lib.ctoolswrapper import CToolsWrapper
 from lib.exporter.csv import CSVExporter as csvex
 from lib.utils import li_ma
 from lib.photometry import Photometrics
+from lib.irf import irf_registry
 import numpy as np
 import argparse
 import logging
@@ -81,12 +82,13 @@ data_to_analyze.append({ 'tmax': args.tmax,
                          'ra':  pnt['ra'],
                          'dec': pnt['dec'],
                          'emin': sobs.energy_min,
-                         'emax': sobs.energy_max, })
+                         'emax': sobs.energy_max,
+                         'band': 0, })
 
 # energy selection for max time
 if True:
     t = args.tmax
-    for en in ENERGY_SELECTION[1:]:
+    for band, en in enumerate(ENERGY_SELECTION[1:], start=1):
         sel_working_dir = os.path.join(working_dir, 'sel_{0:04d}_{1:.3f}_{2:.3f}'.format(t, en['min'], en['max']))
         if not os.path.isdir(sel_working_dir):
             os.mkdir(sel_working_dir)
@@ -100,7 +102,8 @@ if True:
                                  'ra':  pnt['ra'],
                                  'dec': pnt['dec'],
                                  'emin': en['min'],
-                                 'emax': en['max'], })
+                                 'emax': en['max'],
+                                 'band': band, })
         logging.info("Selection {} done.".format(sel_working_dir))
 
 # selections
@@ -109,7 +112,7 @@ for t in TIME_SELECTION_SLOTS:
         logging.warning('Skipping time {} because greater of tmax.'.format(t))
         continue
 
-    for en in ENERGY_SELECTION:
+    for band, en in enumerate(ENERGY_SELECTION):
         sel_working_dir = os.path.join(working_dir, 'sel_{0:04d}_{1:.3f}_{2:.3f}'.format(t, en['min'], en['max']))
         if not os.path.isdir(sel_working_dir):
             os.mkdir(sel_working_dir)
@@ -123,38 +126,36 @@ for t in TIME_SELECTION_SLOTS:
                                  'ra':  pnt['ra'],
                                  'dec': pnt['dec'],
                                  'emin': en['min'],
-                                 'emax': en['max'], })
+                                 'emax': en['max'],
+                                 'band': band, })
         logging.info("Selection {} done.".format(sel_working_dir))
 
-def events_gammalib2rec(obs_list):
-    events = obs_list[0].events() # GCTAEventList
-    fits = gammalib.GFits()
-    events.write(fits) # GFits
-    events_bintable = fits.table('EVENTS') # GFitsTable
-    events_num = events_bintable.nrows()
-    if events_num > 0:
-        tuples = [ (events_bintable['RA'][i], events_bintable['DEC'][i], events_bintable['ENERGY'][i]) for i in range(events_num) ]
-        return np.rec.array(tuples, formats='float,float,float', names='RA,DEC,ENERGY')
-    else:
-        return None
-
 def photometrics_counts(data):
-    events_list = events_gammalib2rec(data['obs_list'])
-    if events_list is None:
+    phm = Photometrics.from_gammalib(data['obs_list'])
+    if phm is None:
         return { 'on': 0, 'off': 0, 'alpha': None, 'excess': None }
-    phm = Photometrics({ 'events_list': events_list })
     pnt_coords = { 'ra': data['ra'], 'dec': data['dec'] }
     source_coords = { 'ra': SOURCE['ra'], 'dec': SOURCE['dec'] }
     region_rad = 0.2
     reflected_regions = phm.reflected_regions(pnt_coords, source_coords, region_rad)
-    on_count = phm.region_counter(source_coords, region_rad, emin=data['emin'], emax=data['emax'])
-    off_count = 0
-    for r in reflected_regions:
-        off_count += phm.region_counter(r, r['rad'], emin=data['emin'], emax=data['emax'])
+    source_region = { 'ra': SOURCE['ra'], 'dec': SOURCE['dec'], 'rad': region_rad }
+    counts = phm.count_regions([source_region] + reflected_regions, emin=data['emin'], emax=data['emax'])
+    on_count = counts[0]
+    off_count = np.sum(counts[1:])
     alpha = 1/len(reflected_regions)
     return { 'on': on_count, 'off': off_count, 'alpha': alpha, 'excess': on_count - alpha * off_count }
 
+def region_effective_areas(pointing):
+    """region effective area [cm²] of all the energy selections, evaluated at once"""
+    if 'CALDB' not in os.environ:
+        raise Exception('CALDB environment variable is not set, it is needed to read the {} irf'.format(SOURCE['irf']))
+    irf_file = os.path.join(os.environ['CALDB'], 'data', 'cta', SOURCE['caldb'], 'bcf', SOURCE['irf'], 'irf_file.fits')
+    energy_bands = [ (en['min'], en['max']) for en in ENERGY_SELECTION ]
+    source_region = { 'ra': SOURCE['ra'], 'dec': SOURCE['dec'], 'rad': 0.2 }
+    return irf_registry.get(irf_file).effective_area().weighted_values_for_bands(source_region, pointing, energy_bands) * 1e4
+
 # on/off analysis
+region_aeff = region_effective_areas(pnt)
 results = []
 for d in data_to_analyze:
     photometrics_results = photometrics_counts(d)
@@ -228,6 +229,7 @@ for d in data_to_analyze:
                      'phm_off': photometrics_results['off'],
                      'phm_excess': photometrics_results['excess'],
                      'phm_li_ma': li_ma(photometrics_results['on'], photometrics_results['off'], photometrics_results['alpha']),
+                     'phm_aeff': region_aeff[d['band']],
                      })
 
 try:
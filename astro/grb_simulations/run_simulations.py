@@ -111,29 +111,18 @@ for t in TIME_SELECTION_SLOTS:
                              'emax': ENERGY['max'], })
     logging.info("Selection {} done.".format(sel_working_dir))
 
-def events_gammalib2rec(obs_list):
-    ev_list = []
-    for obs in obs_list:
-        events = obs.events() # GCTAEventList
-        fits = gammalib.GFits()
-        events.write(fits) # GFits
-        events_bintable = fits.table('EVENTS') # GFitsTable
-        events_num = events_bintable.nrows()
-        tuples = [ (events_bintable['RA'][i], events_bintable['DEC'][i], events_bintable['ENERGY'][i]) for i in range(events_num) ]
-        ev_list += tuples
-    return np.rec.array(ev_list, formats='float,float,float', names='RA,DEC,ENERGY')
-
 def photometrics_counts(data):
-    events_list = events_gammalib2rec(data['obs_list'])
-    phm = Photometrics({ 'events_list': events_list })
+    phm = Photometrics.from_gammalib(data['obs_list'])
+    if phm is None:
+        return { 'on': 0, 'off': 0, 'alpha': None, 'excess': None }
     pnt_coords = { 'ra': data['ra'], 'dec': data['dec'] }
     source_coords = { 'ra': SOURCE['ra'], 'dec': SOURCE['dec'] }
     region_rad = 0.2
     reflected_regions = phm.reflected_regions(pnt_coords, source_coords, region_rad)
-    on_count = phm.region_counter(source_coords, region_rad) # no energy thresholds, emin=data['emin'], emax=data['emax'])
-    off_count = 0
-    for r in reflected_regions:
-        off_count += phm.region_counter(r, r['rad']) # no energy thresholds emin=data['emin'], emax=data['emax'])
+    source_region = { 'ra': SOURCE['ra'], 'dec': SOURCE['dec'], 'rad': region_rad }
+    counts = phm.count_regions([source_region] + reflected_regions) # no energy thresholds, emin=data['emin'], emax=data['emax'])
+    on_count = counts[0]
+    off_count = np.sum(counts[1:])
     alpha = 1/len(reflected_regions)
     return { 'on': on_count, 'off': off_count, 'alpha': alpha, 'excess': on_count - alpha * off_count }
 
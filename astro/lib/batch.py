@@ -0,0 +1,113 @@
+# Copyright 2019,2020 Simone Tampieri
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import csv
+import itertools
+import multiprocessing
+import os
+from lib.irf import irf_registry
+
+BATCH_FIELDS = ['irf', 'ra', 'dec', 'rad', 'pnt_ra', 'pnt_dec', 'emin', 'emax', 'aeff']
+
+def get_batch_tasks(irf_files, regions, pointings, energy_bands):
+    """return the (irf, region, pointing, band) combinations, the irf file changes slowest"""
+    for irf_filename, region, pointing, band in itertools.product(irf_files, regions, pointings, energy_bands):
+        if len(band) != 2:
+            raise Exception('an energy band needs two energies')
+        yield irf_filename, region, pointing, band
+
+def eval_batch_task(task, pixel_size=0.05, spectrum=-2.4):
+    irf_filename, region, pointing, band = task
+    aeff = irf_registry.get(irf_filename).effective_area()
+    value = aeff.weighted_value_for_region(region, pointing, band, pixel_size, spectrum=spectrum)
+    return { 'irf': irf_filename, 'ra': region['ra'], 'dec': region['dec'], 'rad': region['rad'],
+             'pnt_ra': pointing['ra'], 'pnt_dec': pointing['dec'], 'emin': band[0], 'emax': band[1],
+             # m² => cm²
+             'aeff': float(value) * 1e4 }
+
+class BatchTaskEvaluator:
+    """picklable task function for the pool workers"""
+    def __init__(self, pixel_size, spectrum):
+        self.pixel_size = pixel_size
+        self.spectrum = spectrum
+
+    def __call__(self, task):
+        return eval_batch_task(task, self.pixel_size, self.spectrum)
+
+def load_irfs(irf_files):
+    """load the irfs in the registry of this process"""
+    for irf_filename in irf_files:
+        irf_registry.get(irf_filename)
+
+def evaluate_aeff_batch(irf_files, regions, pointings, energy_bands, pixel_size=0.05, spectrum=-2.4, processes=None, output=None, chunksize=8):
+    """
+    evaluate the region effective area [cm²] for every combination of irf
+    files, regions, pointings and energy bands in a process pool.
+    The rows are yielded in the input order as they are ready.
+
+    Parameters
+      irf_files: a list of irf filenames
+      regions: a list of { 'ra': ..., 'dec': ..., 'rad': ... }
+      pointings: a list of { 'ra': ..., 'dec': ... }
+      energy_bands: a list of couples of energies in TeV
+      pixel_size: a value in degree (default: 0.05)
+      spectrum: a Spectrum, a power law index or a FileFunction filename (default: -2.4)
+      processes: the pool size (default: the cpu count). With 1 no pool is used.
+      output: if present, a .tsv filename where the rows are streamed
+    """
+    tasks = get_batch_tasks(irf_files, regions, pointings, energy_bands)
+    task_fn = BatchTaskEvaluator(pixel_size, spectrum)
+    load_irfs(irf_files)
+
+    fh = None
+    writer = None
+    if output is not None:
+        fh = open(output, mode='w', newline='\n')
+        writer = csv.DictWriter(fh, fieldnames=BATCH_FIELDS, delimiter='\t')
+        writer.writeheader()
+
+    pool = None
+    try:
+        if processes == 1:
+            rows = map(task_fn, tasks)
+        else:
+            # forked workers share the irfs loaded here, with the other start
+            # methods (spawn, forkserver) each worker loads them once on start
+            if 'fork' in multiprocessing.get_all_start_methods():
+                pool = multiprocessing.get_context('fork').Pool(processes or os.cpu_count())
+            else:
+                pool = multiprocessing.Pool(processes or os.cpu_count(), initializer=load_irfs, initargs=(irf_files,))
+            rows = pool.imap(task_fn, tasks, chunksize=chunksize)
+        for row in rows:
+            if writer is not None:
+                writer.writerow(row)
+            yield row
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if fh is not None:
+            fh.close()
@@ -0,0 +1,119 @@
+# Copyright 2019,2020 Simone Tampieri
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+import os
+import tempfile
+
+# file checksums already computed by this process,
+# keyed by (path, size, mtime) so a changed file gets hashed again
+_checksums = {}
+
+def file_checksum(filename, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file content."""
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    if key not in _checksums:
+        digest = hashlib.sha256()
+        with open(filename, mode='rb') as fh:
+            for chunk in iter(lambda: fh.read(chunk_size), b''):
+                digest.update(chunk)
+        _checksums[key] = digest.hexdigest()
+    return _checksums[key]
+
+class DiskCache:
+    """Small key/value store on disk, one json file per entry.
+
+    Entries are written in a temporary file and renamed in place, so
+    concurrent readers see a complete entry or no entry at all. When the
+    cache directory grows over max_size bytes the least recently used
+    entries are removed.
+    """
+    def __init__(self, cache_dir, max_size=64 * 1024**2):
+        if max_size <= 0:
+            raise Exception('cache max size must be > 0')
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(*args):
+        """Build an entry key from json serializable arguments."""
+        payload = json.dumps(args, sort_keys=True, default=float)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def entry_filename(self, key):
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def get(self, key, default=None):
+        filename = self.entry_filename(key)
+        try:
+            with open(filename, mode='r') as fh:
+                value = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return default
+        try:
+            # touch the entry: the eviction removes the oldest access first
+            os.utime(filename)
+        except OSError:
+            pass
+        return value
+
+    def set(self, key, value):
+        fd, tmp_filename = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, mode='w') as fh:
+                json.dump(value, fh)
+            os.replace(tmp_filename, self.entry_filename(key))
+        except BaseException:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total_size += stat.st_size
+        for mtime, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # another process already removed it
+                pass
+            total_size -= size
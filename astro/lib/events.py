@@ -0,0 +1,304 @@
+# Copyright 2019,2020 Simone Tampieri
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from astropy.io import fits
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import os
+import sys
+import weakref
+
+class EventsFile():
+    """Memory mapped binary table of an events FITS file.
+
+    Only the header is parsed on open: the rows are read from a np.memmap
+    with the big-endian record layout of the table. The columns are copied
+    (scaled by TSCAL/TZERO and in native byte order) only when asked, for
+    all the rows or in chunks of rows, so files larger than the memory can
+    be streamed.
+
+    Compressed files (gzip, bzip2, zip) can not be mapped: their table is
+    decompressed in memory on open.
+    """
+    # magic numbers of the compressed files read by astropy
+    compression_signatures = (b'\x1f\x8b', b'BZh', b'PK\x03\x04')
+
+    def __init__(self, filename, extension='EVENTS'):
+        self.filename = filename
+        self.raw_rows = None
+        with fits.open(filename, memmap=True) as hdul:
+            hdu = hdul[extension]
+            if not isinstance(hdu, fits.BinTableHDU):
+                raise Exception('{} extension is not a binary table'.format(extension))
+            self.header = hdu.header.copy()
+            self.offset = hdu.fileinfo()['datLoc']
+            self.columns = hdu.columns
+            self.nrows = self.header['NAXIS2']
+            self.names = self.columns.names
+            self.dtype = self.get_record_dtype(self.columns, self.header['NAXIS1'])
+            if self.is_compressed(filename) and self.nrows > 0:
+                # the FITS_rec storage is the raw (big-endian, unscaled) rows
+                self.raw_rows = np.frombuffer(hdu.data.view(np.ndarray).tobytes(), dtype=self.dtype)
+        self.scales = {}
+        # logical columns are stored as 'T'/'F' bytes
+        self.logicals = [ col.name for col in self.columns if col.format.format == 'L' ]
+        for col in self.columns:
+            if col.bscale not in (None, 1) or col.bzero not in (None, 0):
+                self.scales[col.name] = (1 if col.bscale is None else col.bscale, 0 if col.bzero is None else col.bzero)
+
+    @classmethod
+    def is_compressed(cls, filename):
+        with open(filename, mode='rb') as fh:
+            magic = fh.read(4)
+        return any(magic.startswith(signature) for signature in cls.compression_signatures)
+
+    @staticmethod
+    def get_record_dtype(columns, row_size):
+        """return the big-endian numpy dtype of a table row"""
+        names, formats, offsets = [], [], []
+        offset = 0
+        for col in columns:
+            if col.format.recformat.startswith('P') or col.format.recformat.startswith('Q'):
+                raise Exception('variable length column {} is not supported'.format(col.name))
+            field_dtype = np.dtype(col.format.recformat).newbyteorder('>')
+            names.append(col.name)
+            formats.append(field_dtype)
+            offsets.append(offset)
+            offset += field_dtype.itemsize
+        if offset != row_size:
+            raise Exception('the columns size ({}) does not match the row size ({})'.format(offset, row_size))
+        return np.dtype({ 'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': row_size })
+
+    def rows(self, start=0, stop=None):
+        """return the raw rows [start, stop) as a read-only np.memmap (or array, for compressed files)"""
+        start, stop, step = slice(start, stop).indices(self.nrows)
+        if stop <= start:
+            return np.zeros(0, dtype=self.dtype)
+        if self.raw_rows is not None:
+            return self.raw_rows[start:stop]
+        return np.memmap(self.filename, dtype=self.dtype, mode='r', offset=self.offset + start * self.dtype.itemsize, shape=(stop - start,))
+
+    def get_column(self, rows, name):
+        """return a column of raw rows, scaled and in native byte order"""
+        values = rows[name]
+        if name in self.logicals:
+            return values == ord('T')
+        if name not in self.scales:
+            return values.astype(values.dtype.newbyteorder('='))
+        scale, zero = self.scales[name]
+        if values.dtype.kind in 'iu' and scale == 1 and float(zero).is_integer():
+            # ex: unsigned integers stored with an offset
+            return values.astype(np.int64) + int(zero)
+        return values.astype(np.float64) * scale + zero
+
+    def check_columns(self, columns):
+        columns = self.names if columns is None else list(columns)
+        for c in columns:
+            if c not in self.names:
+                raise Exception("Events data has no '{}' col".format(c))
+        return columns
+
+    def read(self, columns=None, start=0, stop=None):
+        """return a dict of the columns arrays for the rows [start, stop)"""
+        columns = self.check_columns(columns)
+        rows = self.rows(start, stop)
+        return { c: self.get_column(rows, c) for c in columns }
+
+    def read_recarray(self, columns=None):
+        """return the columns as a np.recarray"""
+        columns = self.check_columns(columns)
+        data = self.read(columns)
+        return np.rec.fromarrays([ data[c] for c in columns ], names=columns)
+
+    def chunks(self, columns=None, chunk_size=1000000):
+        """yield dicts of the columns arrays, chunk_size rows at time"""
+        columns = self.check_columns(columns)
+        if chunk_size < 1:
+            raise Exception('chunk size must be > 0')
+        for start in range(0, self.nrows, chunk_size):
+            # every chunk has its own mapping, released with the chunk
+            chunk = self.rows(start, start + chunk_size)
+            yield { c: self.get_column(chunk, c) for c in columns }
+
+class EventStore():
+    """Columnar events list: one contiguous array per column.
+
+    The columns keep their native dtype; with float32 the float64 columns
+    are stored as float32, but TIME that needs the double precision. A store
+    copied in shared memory (to_shared) can be attached by other processes
+    (attach) without copies. It has the field/dtype/len/slicing interface of
+    the record arrays, so Photometrics can use it as events list.
+    """
+    def __init__(self, columns, shm=None):
+        self.columns = columns
+        self.shm = shm
+        self.shm_owner = False
+        self.layout = None
+
+    @staticmethod
+    def get_column_dtype(name, dtype, float32=False):
+        dtype = np.dtype(dtype).newbyteorder('=')
+        if float32 and dtype == np.float64 and name != 'TIME':
+            return np.dtype(np.float32)
+        return dtype
+
+    @classmethod
+    def from_arrays(cls, columns, float32=False):
+        """build a store from a dict of column arrays (copied)"""
+        lengths = set(len(values) for values in columns.values())
+        if len(lengths) > 1:
+            raise Exception('the columns must have the same length')
+        return cls({ name: np.ascontiguousarray(values, dtype=cls.get_column_dtype(name, np.asarray(values).dtype, float32)) for name, values in columns.items() })
+
+    @classmethod
+    def from_recarray(cls, data, columns=None, float32=False):
+        """build a store from a np.recarray or a FITS_rec"""
+        names = data.dtype.names if columns is None else columns
+        return cls.from_arrays({ name: data.field(name) for name in names }, float32)
+
+    @classmethod
+    def from_file(cls, filename, columns=None, float32=False, extension='EVENTS'):
+        """build a store reading the columns of an events file (see EventsFile)"""
+        data = EventsFile(filename, extension).read(columns)
+        return cls({ name: values.astype(cls.get_column_dtype(name, values.dtype, float32), copy=False) for name, values in data.items() })
+
+    @property
+    def names(self):
+        return tuple(self.columns.keys())
+
+    @property
+    def dtype(self):
+        return np.dtype([ (name, values.dtype, values.shape[1:]) for name, values in self.columns.items() ])
+
+    @property
+    def nbytes(self):
+        return sum(values.nbytes for values in self.columns.values())
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(next(iter(self.columns.values())))
+
+    def field(self, name):
+        if name not in self.columns:
+            raise Exception("Events data has no '{}' col".format(name))
+        return self.columns[name]
+
+    def __getitem__(self, key):
+        """a column by name, or a new store with the selected rows (a view for slices)"""
+        if isinstance(key, str):
+            return self.field(key)
+        return EventStore({ name: values[key] for name, values in self.columns.items() })
+
+    def to_shared(self, name=None):
+        """return a copy of the store in a new shared memory block
+
+        The caller owns the block: close() and unlink() it when the workers
+        are done. descriptor() returns what attach needs.
+        """
+        layout = []
+        offset = 0
+        for column, values in self.columns.items():
+            # 64 bytes aligned columns
+            offset = (offset + 63) // 64 * 64
+            layout.append((column, values.dtype.str, values.shape, offset))
+            offset += values.nbytes
+        shm = shared_memory.SharedMemory(name=name, create=True, size=max(offset, 1))
+        store = self.from_shared_buffer(shm, layout)
+        for column, values in self.columns.items():
+            store.columns[column][...] = values
+        store.shm_owner = True
+        return store
+
+    @classmethod
+    def from_shared_buffer(cls, shm, layout, writeable=True):
+        # frombuffer holds an export of the block buffer for every view, so
+        # the block cannot be unmapped (shm.close) while a view is alive
+        columns = { column: np.frombuffer(shm.buf, dtype=np.dtype(dtype), count=int(np.prod(shape)), offset=offset).reshape(shape) for column, dtype, shape, offset in layout }
+        store = cls(columns, shm=shm)
+        store.layout = layout
+        if not writeable:
+            for values in columns.values():
+                values.flags.writeable = False
+        return store
+
+    def descriptor(self):
+        """return the picklable description of a shared store"""
+        if self.shm is None:
+            raise Exception('the events store is not in shared memory')
+        return { 'name': self.shm.name, 'layout': self.layout }
+
+    @classmethod
+    def attach(cls, descriptor):
+        """return a read only store over the shared memory block of descriptor
+
+        Only the owner tracks (and unlinks) the block. Before python 3.13 the
+        opening always registers the block in the resource tracker, so it is
+        unregistered right after: the tracker of a worker would otherwise
+        unlink the block when the worker exits. Pool workers share the owner
+        tracker, where concurrent attaches can log a harmless KeyError.
+        """
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=descriptor['name'], track=False)
+        else:
+            shm = shared_memory.SharedMemory(name=descriptor['name'])
+            if os.name == 'posix':
+                resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls.from_shared_buffer(shm, descriptor['layout'], writeable=False)
+
+    @staticmethod
+    def get_root_array(values):
+        while isinstance(values.base, np.ndarray):
+            values = values.base
+        return values
+
+    def close(self):
+        """release the shared memory mapping, the store is no longer usable
+
+        Raises if other arrays (slices of the store, columns taken with field
+        or a Photometrics built on it) still view the block: they must be
+        released first.
+        """
+        if self.shm is None:
+            return
+        # the views of a column have its root array (the frombuffer one) as
+        # base: a root still alive without the store means a view in use
+        roots = [ weakref.ref(self.get_root_array(values)) for values in self.columns.values() ]
+        self.columns = {}
+        if any(ref() is not None for ref in roots):
+            self.columns = self.from_shared_buffer(self.shm, self.layout, writeable=self.shm_owner).columns
+            raise Exception('the shared events store has live views, release them before close')
+        self.shm.close()
+
+    def unlink(self):
+        """destroy the shared memory block (owner only)"""
+        if self.shm is not None and self.shm_owner:
+            if sys.version_info < (3, 13) and os.name == 'posix':
+                # the attaching processes sharing this tracker may have
+                # unregistered the block: register it again, unlink unregisters it
+                resource_tracker.register(self.shm._name, 'shared_memory')
+            self.shm.unlink()
@@ -0,0 +1,89 @@
+# Copyright 2019,2020 Simone Tampieri
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+from astropy.coordinates import SkyCoord
+
+# Vectorized spherical geometry on float64 arrays, in degree.
+# These are the inner loop replacements of the SkyCoord/Angle methods
+# (separation, position_angle, directional_offset_by), with the same
+# conventions: position angles east of north.
+
+def get_radec(coord):
+    """return (ra, dec) [deg] of a SkyCoord or a { 'ra': ..., 'dec': ... } dictionary"""
+    if isinstance(coord, SkyCoord):
+        return coord.ra.deg, coord.dec.deg
+    if isinstance(coord, dict) and 'ra' in coord and 'dec' in coord:
+        return np.asarray(coord['ra'], dtype=float), np.asarray(coord['dec'], dtype=float)
+    raise Exception('The input parameter must be a SkyCoord or a { "ra": 12.3, "dec": 45.6 } dictionary.')
+
+def unit_vectors(ra, dec):
+    """return the (..., 3) cartesian unit vectors of ra, dec arrays [deg]"""
+    ra = np.deg2rad(np.asarray(ra, dtype=float))
+    dec = np.deg2rad(np.asarray(dec, dtype=float))
+    cos_dec = np.cos(dec)
+    return np.stack((cos_dec * np.cos(ra), cos_dec * np.sin(ra), np.sin(dec)), axis=-1)
+
+def chord(radius):
+    """return the distance between unit vectors [deg] separated by radius [deg]"""
+    return 2 * np.sin(np.deg2rad(np.asarray(radius, dtype=float)) / 2)
+
+def separation(ra1, dec1, ra2, dec2):
+    """return the angular distance [deg] between points (Vincenty formula, as astropy)"""
+    ra1, dec1, ra2, dec2 = [ np.deg2rad(np.asarray(v, dtype=float)) for v in (ra1, dec1, ra2, dec2) ]
+    d_ra = ra2 - ra1
+    sin_dec1, cos_dec1 = np.sin(dec1), np.cos(dec1)
+    sin_dec2, cos_dec2 = np.sin(dec2), np.cos(dec2)
+    num1 = cos_dec2 * np.sin(d_ra)
+    num2 = cos_dec1 * sin_dec2 - sin_dec1 * cos_dec2 * np.cos(d_ra)
+    den = sin_dec1 * sin_dec2 + cos_dec1 * cos_dec2 * np.cos(d_ra)
+    return np.rad2deg(np.arctan2(np.hypot(num1, num2), den))
+
+def position_angle(ra1, dec1, ra2, dec2):
+    """return the position angle [deg, 0-360) of the points 2 from the points 1, east of north"""
+    ra1, dec1, ra2, dec2 = [ np.deg2rad(np.asarray(v, dtype=float)) for v in (ra1, dec1, ra2, dec2) ]
+    d_ra = ra2 - ra1
+    x = np.sin(d_ra) * np.cos(dec2)
+    y = np.cos(dec1) * np.sin(dec2) - np.sin(dec1) * np.cos(dec2) * np.cos(d_ra)
+    return np.rad2deg(np.arctan2(x, y)) % 360
+
+def offset_by(ra, dec, pos_angle, distance):
+    """return (ra, dec) [deg] of the points at distance [deg] from (ra, dec) toward pos_angle [deg]"""
+    ra, dec, pos_angle, distance = [ np.deg2rad(np.asarray(v, dtype=float)) for v in (ra, dec, pos_angle, distance) ]
+    sin_dec, cos_dec = np.sin(dec), np.cos(dec)
+    sin_dist, cos_dist = np.sin(distance), np.cos(distance)
+    new_dec = np.arcsin(np.clip(sin_dec * cos_dist + cos_dec * sin_dist * np.cos(pos_angle), -1, 1))
+    new_ra = ra + np.arctan2(np.sin(pos_angle) * sin_dist * cos_dec, cos_dist - sin_dec * np.sin(new_dec))
+    return np.rad2deg(new_ra) % 360, np.rad2deg(new_dec)
+
+def coord_separation(coord1, coord2):
+    """return the angular distance [deg] between two SkyCoord or dictionaries"""
+    return separation(*get_radec(coord1), *get_radec(coord2))
+
+def coord_position_angle(coord1, coord2):
+    """return the position angle [deg] of coord2 from coord1 (SkyCoord or dictionaries)"""
+    return position_angle(*get_radec(coord1), *get_radec(coord2))
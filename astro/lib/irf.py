@@ -26,18 +26,192 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from astropy.io import fits
+from types import SimpleNamespace
+import collections
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
 import numpy as np
 from scipy import interpolate, integrate
 from lib import utils 
-from astropy.coordinates import SkyCoord
+from lib.cache import file_checksum
+from lib.spectrum import get_spectrum
+from lib import sampling
+from lib import geometry
+from astropy.wcs import WCS
 import math
 
+# part of the DiskCache keys of EffectiveArea.weighted_value_for_region: bump it
+# whenever weighted_aeff_flat_psf_w_powerlaw changes its results
+WEIGHTED_AEFF_CACHE_VERSION = 1
+
+def get_bin_indices(bins, values, name='Value'):
+    """return the bin index of each value
+
+    Parameters
+      bins: array of [LO, HI] couples, sorted
+      values: array of values
+
+    Raise an exception if a value is outside the bins.
+    """
+    values = np.asarray(values, dtype=float)
+    indices = np.searchsorted(bins[:, 0], values, side='right') - 1
+    outside = (indices < 0) | (values >= bins[np.clip(indices, 0, len(bins)-1), 1])
+    if np.any(outside):
+        raise Exception('{} is out of range ({})'.format(name, values[outside]))
+    return indices
+
+def get_log_energy_weights(energy_bins, energies):
+    """return the lower node index and the weight of the upper node for the
+    linear interpolation in log10 energy between the bins middle points.
+
+    Raise an exception if an energy is outside the middle points range.
+    """
+    energy_mid = np.mean(np.log10(energy_bins, dtype=float), axis=1)
+    log_energies = np.log10(np.asarray(energies, dtype=float))
+    outside = (log_energies < energy_mid[0]) | (log_energies > energy_mid[-1])
+    if np.any(outside):
+        raise Exception('Energy is out of interpolation range ({})'.format(10**log_energies[outside]))
+    indices = np.clip(np.searchsorted(energy_mid, log_energies, side='right') - 1, 0, len(energy_mid)-2)
+    weights = (log_energies - energy_mid[indices]) / (energy_mid[indices+1] - energy_mid[indices])
+    return indices, weights
+
+def get_log_grid_interpolator(theta_bins, energy_bins, values):
+    """return a linear interpolator over (offset [deg], log10 energy [TeV])
+
+    values are defined on the bins middle points, with shape
+    (theta, energy, ...).
+    """
+    theta_mid  = np.mean(theta_bins, axis=1, dtype=float)
+    energy_mid = np.mean(np.log10(energy_bins, dtype=float), axis=1)
+    return interpolate.RegularGridInterpolator((theta_mid, energy_mid), np.asarray(values, dtype=float), method='linear', bounds_error=False, fill_value=None)
+
+def eval_log_grid_interpolator(interp_fn, offsets, energies):
+    """evaluate an interpolator built by get_log_grid_interpolator
+
+    Offsets [deg] and energies [TeV] are broadcast together. Values outside
+    the grid take the nearest grid value.
+    """
+    theta_mid, energy_mid = interp_fn.grid
+    offsets, log_energies = np.broadcast_arrays(np.asarray(offsets, dtype=float), np.log10(np.asarray(energies, dtype=float)))
+    points = np.stack((np.clip(offsets, theta_mid[0], theta_mid[-1]), np.clip(log_energies, energy_mid[0], energy_mid[-1])), axis=-1)
+    values = interp_fn(points.reshape(-1, 2))
+    return values.reshape(offsets.shape + values.shape[1:])
+
+class BundleTable:
+    """Stand-in for a one row bintable, over the arrays of an IRF bundle.
+
+    It provides the data.field() and columns.names accessors used by the IRF
+    components.
+    """
+    def __init__(self, name, arrays):
+        self.name = name
+        self.arrays = arrays
+        self.columns = SimpleNamespace(names=list(arrays.keys()))
+
+    @property
+    def data(self):
+        return self
+
+    def field(self, name):
+        return self.arrays[name][np.newaxis]
+
+def get_bundle_dir(filename):
+    return filename + '.bundle'
+
+def write_irf_bundle(filename, bundle_dir=None):
+    """Convert the IRF bintables in a directory of .npy files.
+
+    Each column of the one row bintables is saved as native endian array,
+    the manifest.json keeps the files list and the checksum of the source
+    FITS file. The IRF class loads the bundle (memory mapped) instead of
+    the FITS file when it is present and valid.
+    """
+    bundle_dir = get_bundle_dir(filename) if bundle_dir is None else bundle_dir
+    stat = os.stat(filename)
+    manifest = { 'checksum': file_checksum(filename), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'extensions': {} }
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(bundle_dir)))
+    with fits.open(filename, memmap=False) as hdul:
+        for hdu in hdul:
+            if not isinstance(hdu, fits.BinTableHDU) or len(hdu.data) != 1:
+                continue
+            files = {}
+            for i, name in enumerate(hdu.columns.names):
+                column = hdu.data.field(name)[0]
+                array_filename = '{}_{:02d}.npy'.format(hdu.name.replace(' ', '_'), i)
+                np.save(os.path.join(tmp_dir, array_filename), np.ascontiguousarray(column, dtype=column.dtype.newbyteorder('=')))
+                files[name] = array_filename
+            manifest['extensions'][hdu.name] = files
+    with open(os.path.join(tmp_dir, 'manifest.json'), mode='w') as fh:
+        json.dump(manifest, fh, indent=2)
+    if os.path.isdir(bundle_dir):
+        shutil.rmtree(bundle_dir)
+    os.rename(tmp_dir, bundle_dir)
+    return bundle_dir
+
+def read_irf_bundle(filename, bundle_dir=None):
+    """return the bundle tables of an IRF file, by name, or None when the
+    bundle is missing or doesn't match the FITS file.
+    """
+    bundle_dir = get_bundle_dir(filename) if bundle_dir is None else bundle_dir
+    try:
+        with open(os.path.join(bundle_dir, 'manifest.json'), mode='r') as fh:
+            manifest = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return None
+    stat = os.stat(filename)
+    # unchanged size and time are enough, otherwise check the content
+    if stat.st_size != manifest['size'] or stat.st_mtime_ns != manifest['mtime_ns']:
+        if file_checksum(filename) != manifest['checksum']:
+            logging.warning('IRF bundle {} is outdated, reading {}'.format(bundle_dir, filename))
+            return None
+    tables = {}
+    for name, files in manifest['extensions'].items():
+        try:
+            arrays = { col: np.load(os.path.join(bundle_dir, f), mmap_mode='r') for col, f in files.items() }
+        except (FileNotFoundError, ValueError) as e:
+            logging.warning('IRF bundle {} is incomplete ({}), reading {}'.format(bundle_dir, e, filename))
+            return None
+        tables[name] = BundleTable(name, arrays)
+    return tables
+
 class IRF:
+    """IRF file content.
+
+    All the extensions are read in memory and the file is closed. Prefer
+    irf_registry.get(filename) to build one: it parses each file once and
+    shares the components (EffectiveArea, PSF, ...) built over its data.
+    If a valid bundle (see write_irf_bundle) is present, the tables are
+    memory mapped from it and the FITS file is parsed only when the hdul
+    attribute is used.
+    """
     def __init__(self, filename):
         self.filename = filename
-        self.hdul = fits.open(self.filename)
+        # components built over the extensions data, by name
+        self.components = {}
+        self._hdul = None
+        self.bundle_tables = read_irf_bundle(self.filename)
+        if self.bundle_tables is None:
+            self.hdul
+
+    @property
+    def hdul(self):
+        """the FITS extensions, read at the first use in bundle mode"""
+        if self._hdul is None:
+            with fits.open(self.filename, memmap=False) as hdul:
+                for hdu in hdul:
+                    # load the data before closing the file
+                    hdu.data
+                self._hdul = hdul
+        return self._hdul
 
     def get_extension(self, name):
+        if self.bundle_tables is not None:
+            return self.bundle_tables[name]
         return self.hdul[name]
 
     def get_eff_area(self):
@@ -46,19 +220,79 @@ class IRF:
     def get_psf_data(self):
         return self.get_extension('POINT SPREAD FUNCTION')
 
+    def get_edisp_data(self):
+        return self.get_extension('ENERGY DISPERSION')
+
+    def get_bkg_data(self):
+        return self.get_extension('BACKGROUND')
+
+    def get_component(self, name, builder):
+        if name not in self.components:
+            self.components[name] = builder(irf=self)
+        return self.components[name]
+
+    def effective_area(self):
+        return self.get_component('EFFECTIVE AREA', EffectiveArea)
+
+    def psf(self):
+        return self.get_component('POINT SPREAD FUNCTION', PSF)
+
+    def energy_dispersion(self):
+        return self.get_component('ENERGY DISPERSION', EnergyDispersion)
+
+    def background(self):
+        return self.get_component('BACKGROUND', Background)
+
+class IRFRegistry:
+    """Process wide registry of the opened IRF files.
+
+    Each file is parsed once and kept in memory, the least recently used
+    IRFs are dropped when more than max_size are loaded. The arrays are plain
+    in-memory numpy arrays, so the processes forked after the loading read
+    them without copies.
+    """
+    def __init__(self, max_size=8):
+        if max_size < 1:
+            raise Exception('The registry needs room for at least 1 irf')
+        self.max_size = max_size
+        self.irfs = collections.OrderedDict()
+
+    def get(self, filename):
+        # a rewritten file gets a new key, so it is read again
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_mtime_ns)
+        if key in self.irfs:
+            self.irfs.move_to_end(key)
+        else:
+            self.irfs[key] = IRF(filename)
+            while len(self.irfs) > self.max_size:
+                self.irfs.popitem(last=False)
+        return self.irfs[key]
+
+    def clear(self):
+        self.irfs.clear()
+
+irf_registry = IRFRegistry()
+
 class EffectiveArea:
-    def __init__(self, irf_filename=None, eff_area_bintable=None):
+    def __init__(self, irf_filename=None, eff_area_bintable=None, cache=None, irf=None):
         self.irf_filename = None
+        self.irf = None
         self.eff_area = None
+        # optional DiskCache for the region values
+        self.cache = cache
 
         # a sort of cache...
         self.energies = None
         self.thetas = None
         self.aeff_matrix = None
+        self.aeff_interpolator = None
 
         if irf_filename is not None:
-            self.irf_filename = irf_filename
-            irf = IRF(self.irf_filename)
+            irf = irf_registry.get(irf_filename)
+        if irf is not None:
+            self.irf = irf
+            self.irf_filename = irf.filename
             self.eff_area = irf.get_eff_area()
         elif eff_area_bintable is not None:
             self.eff_area = eff_area_bintable
@@ -97,22 +331,15 @@ class EffectiveArea:
 
         This method does 1D interpolation on energy range, managed as log10.
         Theta offset is not interpolated.
+        Offset and energy can be arrays, they are broadcast together.
         """
-        offset_angle = utils.get_angle(offset)
+        offsets, energies = np.broadcast_arrays(utils.get_degrees(offset), np.asarray(energy, dtype=float))
         aeff_matrix, energy_bins, theta_bins = self.get_data_matrices()
-
-        theta_index = None
-        for i, tb in enumerate(theta_bins):
-            if offset_angle.degree >= tb[0] and offset_angle.degree < tb[1]:
-                theta_index = i
-                break
-        if theta_index is None:
-            raise Exception('Theta offset is out of range ({})'.format(offset))
+        theta_indices = get_bin_indices(theta_bins, offsets, 'Theta offset')
 
         # energy interpolation
-        energy_mid = [ (e[0]+e[1])/2 for e in np.log10(energy_bins) ]
-        energy_fn  = interpolate.interp1d(x = energy_mid, y = aeff_matrix[theta_index])
-        return energy_fn(np.log10(energy))
+        energy_indices, weights = get_log_energy_weights(energy_bins, energies)
+        return (1 - weights) * aeff_matrix[theta_indices, energy_indices] + weights * aeff_matrix[theta_indices, energy_indices+1]
 
     def get_aeff_2d_log(self, input_offset, input_energy):
         """
@@ -125,16 +352,61 @@ class EffectiveArea:
         This method does 2D interpolation and manage energy as log10.
         """
         offset_angle = utils.get_angle(input_offset)
-        aeff_matrix, energy_bins, theta_bins = self.get_data_matrices()
+        return float(self.get_aeff_2d_log_batch(offset_angle.degree, input_energy))
 
-        # energy interpolation
-        theta_mid  = [ (t[0]+t[1])/2 for t in theta_bins ]
-        energy_mid = [ (e[0]+e[1])/2 for e in np.log10(energy_bins) ]
-        energy_fn  = interpolate.interp2d(x = energy_mid, y = theta_mid, z = aeff_matrix)
-        return energy_fn(np.log10(input_energy), input_offset)[0]
+    def get_aeff_interpolator(self):
+        """ returns the linear interpolator over (offset [deg], log10 energy [TeV])
+
+        The interpolator is built once and reused by every following call.
+        """
+        if self.aeff_interpolator is None:
+            aeff_matrix, energy_bins, theta_bins = self.get_data_matrices()
+            self.aeff_interpolator = get_log_grid_interpolator(theta_bins, energy_bins, aeff_matrix)
+        return self.aeff_interpolator
+
+    def get_aeff_2d_log_batch(self, offsets, energies):
+        """
+        return effective area array in [m²]
+
+        Parameters
+          offsets: array of offsets [deg]
+          energies: array of energies [TeV]
 
-    def weighted_value_for_region(self, *args):
-        return self.weighted_aeff_flat_psf_w_powerlaw(*args)
+        Offsets and energies are broadcast together, so a column of offsets
+        and a row of energies give the full (offset, energy) matrix.
+        Values outside the IRF grid take the nearest grid value.
+        """
+        return eval_log_grid_interpolator(self.get_aeff_interpolator(), offsets, energies)
+
+    def checksum(self):
+        """ returns the checksum of the data source (irf file or aeff matrices)
+        """
+        if self.irf_filename is not None:
+            return file_checksum(self.irf_filename)
+        digest = hashlib.sha256()
+        for m in self.get_data_matrices():
+            digest.update(np.ascontiguousarray(m).tobytes())
+        return digest.hexdigest()
+
+    def weighted_value_for_region(self, region, pointing, input_energies, pixel_size=0.05, e_index=-2.4, spectrum=None):
+        """return effective area value [m²] for a specific region
+
+        If the instance has a cache the value is looked up there first, and
+        stored after the evaluation.
+        """
+        spec = get_spectrum(e_index if spectrum is None else spectrum)
+        if self.cache is None:
+            return self.weighted_aeff_flat_psf_w_powerlaw(region, pointing, input_energies, pixel_size, spectrum=spec)
+
+        key = self.cache.key(self.checksum(), 'weighted_aeff_flat_psf_w_powerlaw', WEIGHTED_AEFF_CACHE_VERSION,
+                             { k: float(region[k]) for k in ['ra', 'dec', 'rad'] },
+                             { k: float(pointing[k]) for k in ['ra', 'dec'] },
+                             [ float(e) for e in input_energies ], float(pixel_size), spec.signature())
+        val = self.cache.get(key)
+        if val is None:
+            val = float(self.weighted_aeff_flat_psf_w_powerlaw(region, pointing, input_energies, pixel_size, spectrum=spec))
+            self.cache.set(key, val)
+        return val
 
     # FIXME the idea is integrate psf gradually but the offset from center and from pointing works differently
     # we need to associate the PSF degradation from source region center
@@ -144,7 +416,7 @@ class EffectiveArea:
 
     # this method use the psf value plain as it easy for energy weight. doesn't
     # consider the spatial component of the PSF
-    def weighted_aeff_flat_psf_w_powerlaw(self, region, pointing, input_energies, pixel_size=0.05, e_index=-2.4):
+    def weighted_aeff_flat_psf_w_powerlaw(self, region, pointing, input_energies, pixel_size=0.05, e_index=-2.4, spectrum=None):
         """return effective area value [m²] for a specific region
 
         Parameters
@@ -153,48 +425,33 @@ class EffectiveArea:
           energies: a couple of values in TeV (ex: [ 0.025, 1.0 ])
           pixel_size: a value in degree (default: 0.05)
           e_index: is the powerlaw index (default: -2.4)
+          spectrum: a Spectrum or a FileFunction filename, used instead of e_index
         """
         if len(input_energies) != 2:
             raise Exception('need two energies')
 
-        psf = PSF(irf_filename=self.irf_filename)
+        if self.irf is None:
+            raise Exception('Need an irf to evaluate the psf')
+        psf = self.irf.psf()
 
-        # create a grid of points
-        points = self.create_pixel_map(region, pixel_size)
-        # select the points inside the region
-        internal_points = self.select_points_in_region(points, region)
-        # calculate the offsets
-        offsets = self.get_thetas(pointing, internal_points)
+        offsets = self.get_region_offsets(region, pointing, pixel_size)
 
-        log_energies = np.log10(input_energies)
-        # N steps for every unit of log energy
-        steps = int(np.ceil(log_energies[1]-log_energies[0]) * 10)
-        energies = 10**np.linspace(log_energies[0], log_energies[1], steps)
-        powerlaw = lambda x: x**e_index
-        i_full = integrate.quad(powerlaw, input_energies[0], input_energies[1])
-        i_partials = [ integrate.quad(powerlaw, energies[i], energies[i+1]) for i,v in enumerate(energies[:-1]) ]
-        i_factor = [ p[0]/i_full[0] for p in i_partials ]
-        energies_middle = (energies[1:]+energies[:-1])/2
+        energies, energies_middle = self.get_energy_bins(input_energies)
+        i_factor = get_spectrum(e_index if spectrum is None else spectrum).bin_weights(energies)
 
-        psf_engines = {}
-        for en in energies_middle:
-            psf_engines[en] = psf.get_psf_engine(region, pointing, en)
-        region_radius_rad = np.deg2rad(region['rad'])
-
-        n_points = len(offsets)
-        val = 0
-        for t in offsets:
-            for i, en in enumerate(energies_middle):
-                psf_rate = psf_engines[en](0, region_radius_rad)[0]
-                val += self.get_aeff_2d_log(t, en) * i_factor[i] * psf_rate / n_points
-        return val
+        # the psf containment depends by the region center offset
+        theta = geometry.coord_separation(pointing, region)
+        psf_rates = psf.containment(region['rad'], theta, energies_middle)
+
+        aeff_values = self.get_aeff_2d_log_batch(offsets[:, np.newaxis], energies_middle)
+        return np.sum(aeff_values * i_factor * psf_rates) / len(offsets)
 
     # this method use an energy range to evaluate the aeff.
     # The energy range is binned and weighted with a powerlaw with index = e_index.
     # Each pixel has a radial weigth and a specific column of energies weight.
     # Lower energies have more weigth than higher.
     # if energy range is small, the effect is trascurable - similar to weighted_value_for_region_single_energy method.
-    def weighted_value_for_region_w_powerlaw(self, region, pointing, input_energies, pixel_size=0.05, e_index=-2.4):
+    def weighted_value_for_region_w_powerlaw(self, region, pointing, input_energies, pixel_size=0.05, e_index=-2.4, spectrum=None):
         """return effective area value [m²] for a specific region
 
         Parameters
@@ -203,32 +460,53 @@ class EffectiveArea:
           energies: a couple of values in TeV (ex: [ 0.025, 1.0 ])
           pixel_size: a value in degree (default: 0.05)
           e_index: is the powerlaw index (default: -2.4)
+          spectrum: a Spectrum or a FileFunction filename, used instead of e_index
         """
         if len(input_energies) != 2:
             raise Exception('need two energies')
 
-        # create a grid of points
-        points = self.create_pixel_map(region, pixel_size)
-        # select the points inside the region
-        internal_points = self.select_points_in_region(points, region)
-        # calculate the offsets
-        offsets = self.get_thetas(pointing, internal_points)
+        offsets = self.get_region_offsets(region, pointing, pixel_size)
 
-        log_energies = np.log10(input_energies)
-        # N steps for every unit of log energy
-        steps = int(np.ceil(log_energies[1]-log_energies[0]) * 10)
-        energies = 10**np.linspace(log_energies[0], log_energies[1], steps)
-        powerlaw = lambda x: x**e_index
-        i_full = integrate.quad(powerlaw, input_energies[0], input_energies[1])
-        i_partials = [ integrate.quad(powerlaw, energies[i], energies[i+1]) for i,v in enumerate(energies[:-1]) ]
-        i_factor = [ p[0]/i_full[0] for p in i_partials ]
-        energies_middle = (energies[1:]+energies[:-1])/2
-        n_points = len(offsets)
-        val = 0
-        for t in offsets:
-            for i, en in enumerate(energies_middle):
-                val += self.get_aeff_2d_log(t, en) * i_factor[i] / n_points
-        return val
+        energies, energies_middle = self.get_energy_bins(input_energies)
+        i_factor = get_spectrum(e_index if spectrum is None else spectrum).bin_weights(energies)
+
+        aeff_values = self.get_aeff_2d_log_batch(offsets[:, np.newaxis], energies_middle)
+        return np.sum(aeff_values * i_factor) / len(offsets)
+
+    def weighted_values_for_bands(self, region, pointing, energy_bands, pixel_size=0.05, e_index=-2.4, spectrum=None, flat_psf=True):
+        """return effective area values [m²] for a specific region, one for every energy band
+
+        Parameters
+          region:   { 'ra': ..., 'dec': ..., 'rad': ... }
+          pointing: { 'ra': ..., 'dec': ... }
+          energy_bands: a list of couples of values in TeV (ex: [[ 0.025, 1.0 ], [ 1.0, 150.0 ]])
+          pixel_size: a value in degree (default: 0.05)
+          e_index: is the powerlaw index (default: -2.4)
+          spectrum: a Spectrum or a FileFunction filename, used instead of e_index
+          flat_psf: weight with the psf containment like weighted_aeff_flat_psf_w_powerlaw,
+                    otherwise the values are the weighted_value_for_region_w_powerlaw ones
+
+        The region offsets are sampled once and the energy bins of all the
+        bands are interpolated in a single batch.
+        """
+        for band in energy_bands:
+            if len(band) != 2:
+                raise Exception('need two energies')
+        spec = get_spectrum(e_index if spectrum is None else spectrum)
+        bins = [ self.get_energy_bins(band) for band in energy_bands ]
+        energies_middle = np.concatenate([ middle for edges, middle in bins ])
+        i_factor = np.concatenate([ spec.bin_weights(edges) for edges, middle in bins ])
+
+        if flat_psf:
+            if self.irf is None:
+                raise Exception('Need an irf to evaluate the psf')
+            theta = geometry.coord_separation(pointing, region)
+            i_factor = i_factor * self.irf.psf().containment(region['rad'], theta, energies_middle)
+
+        offsets = self.get_region_offsets(region, pointing, pixel_size)
+        values = np.mean(self.get_aeff_2d_log_batch(offsets[:, np.newaxis], energies_middle), axis=0) * i_factor
+        splits = np.cumsum([ len(middle) for edges, middle in bins ])[:-1]
+        return np.array([ np.sum(v) for v in np.split(values, splits) ])
 
     # this method use an energy range to evaluate the aeff. The energy range is
     # binned and every matrix cube (pixel distance * energy bin) have the same
@@ -246,23 +524,11 @@ class EffectiveArea:
         if len(input_energies) != 2:
             raise Exception('need two energies')
 
-        # create a grid of points
-        points = self.create_pixel_map(region, pixel_size)
-        # select the points inside the region
-        internal_points = self.select_points_in_region(points, region)
-        # calculate the offsets
-        offsets = self.get_thetas(pointing, internal_points)
+        offsets = self.get_region_offsets(region, pointing, pixel_size)
 
-        log_energies = np.log10(input_energies)
-        diff = np.ceil(log_energies[1]-log_energies[0])
-        steps = int(diff * 10) # N steps for every unit of log energy
-        energies = 10**np.linspace(log_energies[0], log_energies[1], steps)
-        n_points = len(offsets) * len(energies)
-        val = 0
-        for t in offsets:
-            for en in energies:
-                val += self.get_aeff_2d_log(t, en) / n_points
-        return val
+        energies, energies_middle = self.get_energy_bins(input_energies)
+        aeff_values = self.get_aeff_2d_log_batch(offsets[:, np.newaxis], energies)
+        return np.mean(aeff_values)
 
     # Deprecated 2019-12-11
     # this method is old. just a plain output from an array of points and ONE
@@ -276,21 +542,109 @@ class EffectiveArea:
           energy: a value in TeV (ex: 0.025, 1.0, 150.0)
           pixel_size: a value in degree (default: 0.05)
         """
-        # create a grid of points
-        points = self.create_pixel_map(region, pixel_size)
-        # select the points inside the region
-        internal_points = self.select_points_in_region(points, region)
-        # calculate the offsets
-        offsets = self.get_thetas(pointing, internal_points)
+        offsets = self.get_region_offsets(region, pointing, pixel_size)
+
+        return np.mean(self.get_aeff_2d_log_batch(offsets, energy)) # m2
 
-        n_points = len(offsets)
-        val = 0
-        for t in offsets:
-            val += self.get_aeff_2d_log(t, energy) / n_points
-        return val # m2
+    def weighted_value_for_region_adaptive(self, region, pointing, input_energies, rtol=1e-3, e_index=-2.4, spectrum=None):
+        """return effective area value [m²] for a specific region and its error
+
+        Like weighted_value_for_region_w_powerlaw, but the region is sampled
+        with Fibonacci points refined until the relative accuracy is rtol.
+
+        Parameters
+          region:   { 'ra': ..., 'dec': ..., 'rad': ... }
+          pointing: { 'ra': ..., 'dec': ... }
+          energies: a couple of values in TeV (ex: [ 0.025, 1.0 ])
+          rtol: the relative accuracy (default: 1e-3)
+          e_index: is the powerlaw index (default: -2.4)
+          spectrum: a Spectrum or a FileFunction filename, used instead of e_index
+        """
+        if len(input_energies) != 2:
+            raise Exception('need two energies')
+        energies, energies_middle = self.get_energy_bins(input_energies)
+        i_factor = get_spectrum(e_index if spectrum is None else spectrum).bin_weights(energies)
+
+        def region_fn(ra, dec):
+            offsets = geometry.separation(*geometry.get_radec(pointing), ra, dec)
+            return np.sum(self.get_aeff_2d_log_batch(offsets[:, np.newaxis], energies_middle) * i_factor, axis=-1)
+        return sampling.adaptive_region_mean(region_fn, region, rtol=rtol)
+
+    def exposure_map(self, pointing, livetime, energies, binsz=0.02, npix=(200, 200), center=None, spectrum=None, filename=None, overwrite=False):
+        """return exposure [cm² s] and the WCS over a TAN grid of pixels
+
+        Parameters
+          pointing: { 'ra': ..., 'dec': ... }
+          livetime: the observation livetime [s]
+          energies: energy values in TeV. Without spectrum the result is a cube
+                    (energy, y, x) at these energies, with a spectrum they are
+                    bin edges and the result is a spectrum weighted image (y, x)
+          binsz: pixel size in degree (default: 0.02)
+          npix: number of pixels (x, y) (default: (200, 200))
+          center: the map center (default: the pointing)
+          spectrum: a Spectrum, a power law index or a FileFunction filename
+          filename: if present, the map is saved in a FITS file. The cube has
+                    an ENERGIES extension.
+        """
+        energies = np.asarray(energies, dtype=float)
+        center = pointing if center is None else center
+        nx, ny = npix
+        wcs = WCS(naxis=2)
+        wcs.wcs.ctype = ['RA---TAN', 'DEC--TAN']
+        wcs.wcs.crval = [ float(center['ra']), float(center['dec']) ]
+        wcs.wcs.crpix = [ (nx + 1) / 2, (ny + 1) / 2 ]
+        wcs.wcs.cdelt = [ -binsz, binsz ]
+
+        # all the pixels offsets at once
+        x, y = np.meshgrid(np.arange(nx), np.arange(ny))
+        ra, dec = wcs.pixel_to_world_values(x, y)
+        offsets = geometry.separation(*geometry.get_radec(pointing), ra, dec)
+
+        if spectrum is None:
+            # m² => cm²
+            exposure = self.get_aeff_2d_log_batch(offsets[np.newaxis, :, :], energies[:, np.newaxis, np.newaxis]) * 1e4 * livetime
+        else:
+            energies_middle = np.sqrt(energies[1:] * energies[:-1])
+            weights = get_spectrum(spectrum).bin_weights(energies)
+            aeff_values = self.get_aeff_2d_log_batch(offsets[:, :, np.newaxis], energies_middle)
+            exposure = np.sum(aeff_values * weights, axis=-1) * 1e4 * livetime
+
+        if filename is not None:
+            header = wcs.to_header()
+            header['BUNIT'] = 'cm2 s'
+            header['LIVETIME'] = (livetime, 'livetime [s]')
+            hdus = [ fits.PrimaryHDU(data=exposure.astype(np.float32), header=header) ]
+            if spectrum is None:
+                hdus.append(fits.BinTableHDU.from_columns([ fits.Column(name='ENERGY', format='1D', unit='TeV', array=energies) ], name='ENERGIES'))
+            fits.HDUList(hdus).writeto(filename, overwrite=overwrite)
+        return exposure, wcs
 
     # helpers
     @staticmethod
+    def get_energy_bins(input_energies):
+        """returns the energy bin edges and middle points [TeV] for an energy range
+
+        The range is split in 10 steps for every unit of log energy.
+        """
+        log_energies = np.log10(input_energies)
+        # N steps for every unit of log energy
+        steps = int(np.ceil(log_energies[1]-log_energies[0]) * 10)
+        energies = 10**np.linspace(log_energies[0], log_energies[1], steps)
+        energies_middle = (energies[1:]+energies[:-1])/2
+        return energies, energies_middle
+
+    @staticmethod
+    def get_region_offsets(region, pointing, pixel_size=0.05):
+        """return the offsets [deg] from the pointing of a tangent plane grid of pixels in the region"""
+        for k in ['ra', 'dec']:
+            if k in pointing:
+                continue
+            raise Exception('point coord {} is missing.'.format(k))
+        ra, dec = sampling.region_samples(region, pixel_size)
+        return geometry.separation(*geometry.get_radec(pointing), ra, dec)
+
+    # the dict based pixel maps, the weighted methods use get_region_offsets
+    @staticmethod
     def create_pixel_map(region, pixel_side):
         for k in ['ra', 'dec', 'rad']:
             if k in region:
@@ -330,16 +684,10 @@ class EffectiveArea:
         if len(midpoints) < 1:
             raise Exception('need at least 1 point to check')
 
-        region_center = utils.get_skycoord(region)
-        region_radius = utils.get_angle(region['rad'])
-        midpoints_ra = []
-        midpoints_dec = []
-        for p in midpoints:
-            midpoints_ra.append(p['ra'])
-            midpoints_dec.append(p['dec'])
-        midpoints_coords = SkyCoord(midpoints_ra, midpoints_dec, unit='deg', frame='icrs')
-        distances = region_center.separation(midpoints_coords)
-        return np.extract(distances < region_radius, midpoints)
+        midpoints_ra = np.array([ p['ra'] for p in midpoints ], dtype=float)
+        midpoints_dec = np.array([ p['dec'] for p in midpoints ], dtype=float)
+        distances = geometry.separation(*geometry.get_radec(region), midpoints_ra, midpoints_dec)
+        return np.extract(distances < float(utils.get_degrees(region['rad'])), midpoints)
 
     @staticmethod
     def get_thetas(point, midpoints):
@@ -349,29 +697,33 @@ class EffectiveArea:
             raise Exception('point coord {} is missing.'.format(k))
         if len(midpoints) < 1:
             raise Exception('need at least 1 point to check')
-        pnt = utils.get_skycoord(point)
-        midpoints_ra = []
-        midpoints_dec = []
-        for p in midpoints:
-            midpoints_ra.append(p['ra'])
-            midpoints_dec.append(p['dec'])
-        midpoints_coords = SkyCoord(midpoints_ra, midpoints_dec, unit='deg', frame='icrs')
-        return [ ang.degree for ang in pnt.separation(midpoints_coords) ]
+        midpoints_ra = np.array([ p['ra'] for p in midpoints ], dtype=float)
+        midpoints_dec = np.array([ p['dec'] for p in midpoints ], dtype=float)
+        return list(geometry.separation(*geometry.get_radec(point), midpoints_ra, midpoints_dec))
     
 class PSF:
-    def __init__(self, irf_filename=None, psf_bintable=None):
+    fields = ('SIGMA_1', 'SIGMA_2', 'SIGMA_3', 'SCALE', 'AMPL_2', 'AMPL_3')
+
+    def __init__(self, irf_filename=None, psf_bintable=None, irf=None):
         self.irf_filename = None
+        self.irf = None
         self.psf_data = None
-        self.fields = ('SIGMA_1', 'SIGMA_2', 'SIGMA_3', 'SCALE', 'AMPL_2', 'AMPL_3')
 
         # a sort of cache...
         self.energies = None
         self.thetas = None
         self.psf_matrix = None
+        self.valid_psf_matrix = None
+        self.psf_interpolator = None
+        # containment grids interpolators, by fraction and by radius
+        self.containment_radius_grids = {}
+        self.containment_fraction_grids = {}
 
         if irf_filename is not None:
-            self.irf_filename = irf_filename
-            irf = IRF(self.irf_filename)
+            irf = irf_registry.get(irf_filename)
+        if irf is not None:
+            self.irf = irf
+            self.irf_filename = irf.filename
             self.psf_data = irf.get_psf_data()
         elif psf_bintable is not None:
             self.psf_data = psf_bintable
@@ -429,18 +781,16 @@ class PSF:
         Note: 
           scale value ~= 1.0 / (2.0 * np.pi * (sigma_1 + ampl_2 * sigma_2 + ampl_3 * sigma_3))
         """
-        region_center = utils.get_skycoord(region)
-        region_radius = utils.get_angle(region['rad'])
-        pnt_center    = utils.get_skycoord(pointing)
-        theta = pnt_center.separation(region_center)
+        region_radius = float(utils.get_degrees(region['rad']))
+        theta = geometry.coord_separation(pointing, region)
 
         delta_max = self.get_psf_delta_max(theta, energy)
-        if delta_max <= region_radius.degree:
+        if delta_max <= region_radius:
             return (1.0, 0.0)
 
         sigma_1, sigma_2, sigma_3, scale, ampl_2, ampl_3 = self.get_psf_values(theta, energy)
         sigmas2_rad = [ np.deg2rad(s)**2 for s in [sigma_1, sigma_2, sigma_3] ]
-        prefactor_rad = 1.0 / (2.0 * np.pi * sigmas2_rad[0] + ampl_2 * sigmas2_rad[1] + ampl_3 * sigmas2_rad[2])
+        prefactor_rad = 1.0 / (2.0 * np.pi * (sigmas2_rad[0] + ampl_2 * sigmas2_rad[1] + ampl_3 * sigmas2_rad[2]))
 
         def psf_value(delta_rad):
             d2 = delta_rad**2
@@ -451,7 +801,157 @@ class PSF:
 
         # integration to 0 to rad on region circumference of psf value
         crf_psf_fn = lambda delta: psf_value(delta) * 2.0 * np.pi * np.sin(delta)
-        return integrate.quad(crf_psf_fn, 0, np.deg2rad(region_radius.degree))
+        return integrate.quad(crf_psf_fn, 0, np.deg2rad(region_radius))
+
+    def containment(self, radius, offset, energy, exact=False, interpolated=False):
+        """
+        return the psf fraction inside a radius
+
+        Parameters
+          radius: array of radii [deg]
+          offset: array of offsets [deg]
+          energy: array of energies [TeV]
+          exact: integrate numerically instead of using the closed form
+          interpolated: use the psf values of get_psf_2d_log instead of the bin ones
+
+        Inputs are broadcast together. With the small angle approximation the
+        psf integral from 0 to r of a sum of gaussians is
+
+                  Σ aᵢ σᵢ² (1 - exp(-r² / 2σᵢ²))
+           f(r) = ------------------------------      (a₁ = 1)
+                            Σ aᵢ σᵢ²
+
+        The exact mode integrates psf(δ) 2π sin(δ) with quad for each element.
+        """
+        radius, offset, energy = np.broadcast_arrays(utils.get_degrees(radius), utils.get_degrees(offset), np.asarray(energy, dtype=float))
+        if interpolated:
+            values = self.get_psf_2d_log(offset, energy)
+        else:
+            values = self.get_psf_values(offset, energy)
+
+        if not exact:
+            return self.closed_form_containment(values, radius)
+
+        sigmas = np.stack([ values['SIGMA_1'], values['SIGMA_2'], values['SIGMA_3'] ])
+        amplitudes = np.stack([ np.ones(radius.shape), values['AMPL_2'], values['AMPL_3'] ])
+        amplitudes[sigmas <= 0] = 0
+        containment = np.zeros(radius.shape)
+        for i in np.ndindex(radius.shape):
+            valid = amplitudes[(slice(None),) + i] > 0
+            ampls = amplitudes[(slice(None),) + i][valid]
+            sigmas2_rad = np.deg2rad(sigmas[(slice(None),) + i][valid])**2
+            prefactor_rad = 1.0 / (2.0 * np.pi * np.sum(ampls * sigmas2_rad))
+            psf_value = lambda delta_rad: prefactor_rad * np.sum(ampls * np.exp(-1/2 * delta_rad**2 / sigmas2_rad))
+            crf_psf_fn = lambda delta: psf_value(delta) * 2.0 * np.pi * np.sin(delta)
+            containment[i] = integrate.quad(crf_psf_fn, 0, np.deg2rad(radius[i]))[0]
+        return containment
+
+    @staticmethod
+    def closed_form_containment(values, radius):
+        """
+        return the psf fraction inside radius [deg] for psf values arrays
+        (see containment)
+        """
+        sigmas = np.stack([ values['SIGMA_1'], values['SIGMA_2'], values['SIGMA_3'] ])
+        amplitudes = np.stack([ np.ones(sigmas.shape[1:]), values['AMPL_2'], values['AMPL_3'] ])
+        weights = np.where(sigmas > 0, amplitudes * sigmas**2, 0.0)
+        total = np.sum(weights, axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fractions = np.where(sigmas > 0, 1.0 - np.exp(-0.5 * np.asarray(radius, dtype=float)**2 / sigmas**2), 0.0)
+            # bins without psf (all the sigmas are 0) contain nothing
+            return np.where(total > 0, np.sum(weights * fractions, axis=0) / total, 0.0)
+
+    def get_valid_psf_matrix(self):
+        """
+        return the psf data matrix where the empty bins (all the sigmas are
+        0, ex: at the low energy edge of the tables) take the values of the
+        nearest valid bin in energy (or in offset, for an empty offset).
+
+        The grids and the interpolators are built on it, so the empty bins
+        do not spread into the valid ones.
+        """
+        if self.valid_psf_matrix is None:
+            psf_matrix, energy_bins, theta_bins = self.get_data_matrices()
+            valid = np.any([ psf_matrix[f] > 0 for f in ['SIGMA_1', 'SIGMA_2', 'SIGMA_3'] ], axis=0)
+            if not np.any(valid):
+                raise Exception('The psf has no valid bins')
+            matrix = psf_matrix.copy()
+            for i in range(matrix.shape[0]):
+                valid_energies = np.flatnonzero(valid[i])
+                if len(valid_energies) > 0:
+                    nearest = np.abs(np.arange(matrix.shape[1])[:, np.newaxis] - valid_energies).argmin(axis=1)
+                    matrix[i] = matrix[i][valid_energies[nearest]]
+            valid_thetas = np.flatnonzero(np.any(valid, axis=1))
+            nearest = np.abs(np.arange(matrix.shape[0])[:, np.newaxis] - valid_thetas).argmin(axis=1)
+            self.valid_psf_matrix = matrix[valid_thetas[nearest]]
+        return self.valid_psf_matrix
+
+    def get_containment_radius_grid(self, fraction):
+        """
+        return the interpolator of the radius [deg] containing a psf fraction
+        (ex: 0.68) over the IRF (offset, log10 energy) grid.
+
+        The grid is computed once per fraction with a vectorized bisection of
+        the closed form containment on every IRF bin.
+        """
+        fraction = float(fraction)
+        if fraction <= 0 or fraction >= 1:
+            raise Exception('The containment fraction must be in (0, 1)')
+        if fraction not in self.containment_radius_grids:
+            _, energy_bins, theta_bins = self.get_data_matrices()
+            psf_matrix = self.get_valid_psf_matrix()
+            max_sigma = np.max([ psf_matrix[f] for f in ['SIGMA_1', 'SIGMA_2', 'SIGMA_3'] ], axis=0)
+            # each gaussian contains the fraction inside this radius, so the sum does too
+            low  = np.zeros(psf_matrix.shape)
+            high = max_sigma * np.sqrt(-2.0 * np.log(1.0 - fraction))
+            for i in range(60):
+                middle = (low + high) / 2
+                inside = self.closed_form_containment(psf_matrix, middle) >= fraction
+                high = np.where(inside, middle, high)
+                low  = np.where(inside, low, middle)
+            self.containment_radius_grids[fraction] = get_log_grid_interpolator(theta_bins, energy_bins, high)
+        return self.containment_radius_grids[fraction]
+
+    def get_containment_fraction_grid(self, radius):
+        """
+        return the interpolator of the psf fraction inside radius [deg] over
+        the IRF (offset, log10 energy) grid. The grid is computed once per radius.
+        """
+        radius = float(radius)
+        if radius <= 0:
+            raise Exception('The containment radius must be > 0')
+        if radius not in self.containment_fraction_grids:
+            _, energy_bins, theta_bins = self.get_data_matrices()
+            psf_matrix = self.get_valid_psf_matrix()
+            fractions = self.closed_form_containment(psf_matrix, radius)
+            self.containment_fraction_grids[radius] = get_log_grid_interpolator(theta_bins, energy_bins, fractions)
+        return self.containment_fraction_grids[radius]
+
+    def containment_radius(self, fraction, offset, energy):
+        """
+        return the radius [deg] containing a psf fraction (ex: 0.68 for R68)
+
+        Parameters
+          fraction: the containment fraction
+          offset: array of offsets [deg]
+          energy: array of energies [TeV]
+
+        This method interpolates a precomputed grid, see get_containment_radius_grid.
+        """
+        return eval_log_grid_interpolator(self.get_containment_radius_grid(fraction), offset, energy)
+
+    def containment_fraction(self, radius, offset, energy):
+        """
+        return the psf fraction inside a fixed radius [deg]
+
+        Parameters
+          radius: the region radius [deg]
+          offset: array of offsets [deg]
+          energy: array of energies [TeV]
+
+        This method interpolates a precomputed grid, see get_containment_fraction_grid.
+        """
+        return eval_log_grid_interpolator(self.get_containment_fraction_grid(radius), offset, energy)
 
     def get_psf_engine(self, region, pointing, energy):
         """
@@ -464,10 +964,7 @@ class PSF:
             pointing: pointing direction (ra, dec)
             energy: energy in TeV
         """
-        region_center = utils.get_skycoord(region)
-        region_radius = utils.get_angle(region['rad'])
-        pnt_center    = utils.get_skycoord(pointing)
-        theta = pnt_center.separation(region_center)
+        theta = geometry.coord_separation(pointing, region)
 
         # Note: delta_max is not the best things to implement in this context
         #       'cause the integration distance is variabile and there is no
@@ -481,7 +978,7 @@ class PSF:
 
         sigma_1, sigma_2, sigma_3, scale, ampl_2, ampl_3 = self.get_psf_values(theta, energy)
         sigmas2_rad = [ np.deg2rad(s)**2 for s in [sigma_1, sigma_2, sigma_3] ]
-        prefactor_rad = 1.0 / (2.0 * np.pi * sigmas2_rad[0] + ampl_2 * sigmas2_rad[1] + ampl_3 * sigmas2_rad[2])
+        prefactor_rad = 1.0 / (2.0 * np.pi * (sigmas2_rad[0] + ampl_2 * sigmas2_rad[1] + ampl_3 * sigmas2_rad[2]))
 
         def _integrate_psf(start_rad, stop_rad):
             # typical params:
@@ -511,13 +1008,8 @@ class PSF:
 
         max delta value is = 5*sigma value. 
         """
-        sigma_1, sigma_2, sigma_3, scale, ampl_2, ampl_3 = self.get_psf_values(offset, energy)
-        sigma = sigma_1
-        if sigma_2 > sigma:
-            sigma = sigma_2
-        if sigma_3 > sigma:
-            sigma = sigma_3
-        return 5.0 * sigma
+        values = self.get_psf_values(offset, energy)
+        return 5.0 * np.max([ values['SIGMA_1'], values['SIGMA_2'], values['SIGMA_3'] ], axis=0)
 
     def get_psf_values(self, offset, energy):
         """
@@ -528,25 +1020,12 @@ class PSF:
           energy: [TeV]
 
         This method returns plain value. No interpolation.
+        Offset and energy can be arrays, they are broadcast together and the
+        result is a structured array with the psf fields.
         """
-        offset_angle = utils.get_angle(offset)
+        offsets, energies = np.broadcast_arrays(utils.get_degrees(offset), np.asarray(energy, dtype=float))
         psf_matrix, energy_bins, theta_bins = self.get_data_matrices()
-
-        theta_index = None
-        energy_index = None
-        for i, tb in enumerate(theta_bins):
-            if offset_angle.degree >= tb[0] and offset_angle.degree < tb[1]:
-                theta_index = i
-                break
-        for j, en in enumerate(energy_bins):
-            if energy >= en[0] and energy < en[1]:
-                energy_index = j
-                break
-        if theta_index is None:
-            raise Exception('Theta offset is out of range ({})'.format(offset))
-        if energy_index is None:
-            raise Exception('Energy is out of range ({})'.format(energy))
-        return psf_matrix[theta_index, energy_index]
+        return psf_matrix[get_bin_indices(theta_bins, offsets, 'Theta offset'), get_bin_indices(energy_bins, energies, 'Energy')]
 
     # this interpolated is a test
     def get_psf_1d_log(self, offset, energy):
@@ -559,23 +1038,488 @@ class PSF:
 
         This method does 1D interpolation on energy range, managed as log10.
         Theta offset is not interpolated.
+        With arrays of offsets and energies the result is a structured array
+        with the psf fields, with scalars it is a tuple.
         """
-        offset_angle = utils.get_angle(offset)
+        offsets, energies = np.broadcast_arrays(utils.get_degrees(offset), np.asarray(energy, dtype=float))
         psf_matrix, energy_bins, theta_bins = self.get_data_matrices()
-
-        theta_index = None
-        for i, tb in enumerate(theta_bins):
-            if offset_angle.degree >= tb[0] and offset_angle.degree < tb[1]:
-                theta_index = i
-                break
-        if theta_index is None:
-            raise Exception('Theta offset is out of range ({})'.format(offset))
+        theta_indices = get_bin_indices(theta_bins, offsets, 'Theta offset')
 
         # energy interpolation
-        energy_mid = [ (e[0]+e[1])/2 for e in np.log10(energy_bins) ]
-        y_values = []
+        energy_indices, weights = get_log_energy_weights(energy_bins, energies)
+        values = np.zeros(offsets.shape, dtype=psf_matrix.dtype)
         for f in self.fields:
-            y_values.append(psf_matrix[theta_index][f])
-        interp_fn = interpolate.interp1d(x = energy_mid, y = y_values)
-        return tuple(interp_fn(np.log10(energy)))
+            values[f] = (1 - weights) * psf_matrix[f][theta_indices, energy_indices] + weights * psf_matrix[f][theta_indices, energy_indices+1]
+        if values.ndim == 0:
+            return values.item()
+        return values
+
+    def get_psf_interpolator(self):
+        """ returns the linear interpolator of all the psf fields over
+        (offset [deg], log10 energy [TeV])
+
+        The interpolator is built once and reused by every following call.
+        """
+        if self.psf_interpolator is None:
+            _, energy_bins, theta_bins = self.get_data_matrices()
+            # the empty bins would pull the neighbours to 0
+            psf_matrix = self.get_valid_psf_matrix()
+            stacked = np.stack([ psf_matrix[f] for f in self.fields ], axis=-1)
+            self.psf_interpolator = get_log_grid_interpolator(theta_bins, energy_bins, stacked)
+        return self.psf_interpolator
+
+    def get_psf_2d_log(self, offset, energy):
+        """
+        return psf data array (sigma_1, sigma_2, sigma_3, scale, ampl_2, ampl_3)
+
+        Parameters
+          offset: array of offsets [deg]
+          energy: array of energies [TeV]
+
+        This method does 2D interpolation of the six fields at once, with
+        energy managed as log10. Values outside the grid take the nearest
+        grid value. The result is a structured array with the psf fields.
+        """
+        stacked = eval_log_grid_interpolator(self.get_psf_interpolator(), utils.get_degrees(offset), energy)
+        values = np.zeros(stacked.shape[:-1], dtype=self.psf_matrix.dtype)
+        for i, f in enumerate(self.fields):
+            values[f] = stacked[..., i]
+        return values
+
+class EnergyDispersion:
+    """Energy dispersion (migration = E_reco / E_true) component.
+
+    The migration matrix is read on the first use. Response matrices are
+    cached by offset bin and binning, folded ones by offset and binning.
+    """
+    def __init__(self, irf_filename=None, edisp_bintable=None, irf=None):
+        self.irf_filename = None
+        self.irf = None
+        self.edisp_data = None
+
+        # a sort of cache...
+        self.energies = None
+        self.migras = None
+        self.thetas = None
+        self.edisp_matrix = None
+        self.migra_cdf = None
+        self.response_matrices = {}
+        self.folded_matrices = {}
+
+        if irf_filename is not None:
+            irf = irf_registry.get(irf_filename)
+        if irf is not None:
+            self.irf = irf
+            self.irf_filename = irf.filename
+            self.edisp_data = irf.get_edisp_data()
+        elif edisp_bintable is not None:
+            self.edisp_data = edisp_bintable
+
+        if self.edisp_data is None:
+            raise Exception('Need an irf or energy dispersion bintable')
+
+    def columns(self):
+        return self.edisp_data.columns
+
+    def data(self):
+        return self.edisp_data.data
+
+    def get_data_matrices(self):
+        """ returns edisp data matrix (theta, migra, energy), energy[LO,HI],
+        migra[LO,HI] and theta[LO,HI]
+        """
+        if self.edisp_matrix is None:
+            data = self.data()
+            self.energies = np.column_stack((data.field('ENERG_LO')[0], data.field('ENERG_HI')[0]))
+            self.migras = np.column_stack((data.field('MIGRA_LO')[0], data.field('MIGRA_HI')[0]))
+            self.thetas = np.column_stack((data.field('THETA_LO')[0], data.field('THETA_HI')[0]))
+            self.edisp_matrix = data.field('MATRIX')[0]
+        return self.edisp_matrix, self.energies, self.migras, self.thetas
+
+    def get_migra_cdf(self):
+        """ returns the migration cumulative distribution on the migra edges,
+        with shape (theta, migra+1, energy)
+        """
+        if self.migra_cdf is None:
+            edisp_matrix, energy_bins, migra_bins, theta_bins = self.get_data_matrices()
+            probabilities = np.asarray(edisp_matrix, dtype=float) * (migra_bins[:, 1] - migra_bins[:, 0])[np.newaxis, :, np.newaxis]
+            self.migra_cdf = np.concatenate((np.zeros(probabilities[:, :1].shape), np.cumsum(probabilities, axis=1)), axis=1)
+        return self.migra_cdf
+
+    def get_response_matrix(self, true_energies, reco_energies, offset, n_samples=10):
+        """
+        return the (true, reco) probability matrix: the element [i, j] is the
+        probability that a photon in the true energy bin i is reconstructed
+        in the reco energy bin j.
+
+        Parameters
+          true_energies: true energy bin edges [TeV]
+          reco_energies: reco energy bin edges [TeV]
+          offset: Angle or [deg]
+          n_samples: true energies sampled in each true bin, log spaced
+
+        The offset is not interpolated, the matrix is cached by offset bin and
+        binning.
+        """
+        true_energies = np.asarray(true_energies, dtype=float)
+        reco_energies = np.asarray(reco_energies, dtype=float)
+        edisp_matrix, energy_bins, migra_bins, theta_bins = self.get_data_matrices()
+        theta_index = int(get_bin_indices(theta_bins, utils.get_degrees(offset), 'Theta offset'))
+        key = (theta_index, tuple(true_energies), tuple(reco_energies), n_samples)
+        if key not in self.response_matrices:
+            cdf = self.get_migra_cdf()[theta_index]
+            migra_edges = np.append(migra_bins[:, 0], migra_bins[-1, 1]).astype(float)
+
+            # log spaced samples in the middle of n_samples sub bins
+            log_edges = np.log10(true_energies)
+            steps = (np.arange(n_samples) + 0.5) / n_samples
+            samples = 10**(log_edges[:-1, np.newaxis] + np.diff(log_edges)[:, np.newaxis] * steps).ravel()
+
+            # true energies outside the table have no response
+            energy_indices = np.searchsorted(energy_bins[:, 0], samples, side='right') - 1
+            valid = (energy_indices >= 0) & (samples < energy_bins[np.clip(energy_indices, 0, len(energy_bins)-1), 1])
+            energy_indices = np.clip(energy_indices, 0, len(energy_bins)-1)
+
+            # cdf of the migration at the reco edges, linear inside the migra bins
+            migras = reco_energies[np.newaxis, :] / samples[:, np.newaxis]
+            migra_indices = np.clip(np.searchsorted(migra_edges, migras, side='right') - 1, 0, len(migra_edges)-2)
+            weights = np.clip((migras - migra_edges[migra_indices]) / (migra_edges[migra_indices+1] - migra_edges[migra_indices]), 0, 1)
+            columns = energy_indices[:, np.newaxis]
+            reco_cdf = (1 - weights) * cdf[migra_indices, columns] + weights * cdf[migra_indices+1, columns]
+            probabilities = np.where(valid[:, np.newaxis], np.diff(reco_cdf, axis=1), 0.0)
+            self.response_matrices[key] = probabilities.reshape(len(true_energies)-1, n_samples, -1).mean(axis=1)
+        return self.response_matrices[key]
+
+    def get_folded_response(self, true_energies, reco_energies, offset, aeff=None):
+        """
+        return the (true, reco) response matrix [m²]: the effective area at the
+        true bins middle point (log10) times the response matrix.
+
+        Parameters
+          true_energies: true energy bin edges [TeV]
+          reco_energies: reco energy bin edges [TeV]
+          offset: Angle or [deg]
+          aeff: an EffectiveArea (default: the one of the same irf)
+        """
+        if aeff is None:
+            if self.irf is None:
+                raise Exception('Need an irf or an effective area to fold the response')
+            aeff = self.irf.effective_area()
+        true_energies = np.asarray(true_energies, dtype=float)
+        reco_energies = np.asarray(reco_energies, dtype=float)
+        offset_deg = float(utils.get_degrees(offset))
+        key = (id(aeff), offset_deg, tuple(true_energies), tuple(reco_energies))
+        # the entry keeps a reference to its aeff: the id can not be reused
+        # by another object while the entry exists
+        cached = self.folded_matrices.get(key)
+        if cached is None or cached[0] is not aeff:
+            true_middle = 10**((np.log10(true_energies[1:]) + np.log10(true_energies[:-1])) / 2)
+            aeff_values = aeff.get_aeff_2d_log_batch(offset_deg, true_middle)
+            cached = (aeff, aeff_values[:, np.newaxis] * self.get_response_matrix(true_energies, reco_energies, offset_deg))
+            self.folded_matrices[key] = cached
+        return cached[1]
+
+    def predict_counts(self, spectrum, true_energies, reco_energies, offset, livetime, aeff=None):
+        """
+        return the expected counts in each reco energy bin
+
+        Parameters
+          spectrum: a Spectrum with flux in ph/cm²/s/TeV (see lib.spectrum)
+          true_energies: true energy bin edges [TeV]
+          reco_energies: reco energy bin edges [TeV]
+          offset: Angle or [deg]
+          livetime: [s]
+          aeff: an EffectiveArea (default: the one of the same irf)
+        """
+        # ph/cm²/s in each true bin
+        fluxes = get_spectrum(spectrum).integral(true_energies)
+        # m² => cm²
+        return fluxes @ self.get_folded_response(true_energies, reco_energies, offset, aeff) * 1e4 * livetime
+
+class Background:
+    """Background3D component: rate [1/(MeV s sr)] over (energy, DETY, DETX).
+
+    Detector coordinates are the offset from the pointing projected along
+    the position angle: detx = θ cos(pa), dety = θ sin(pa).
+    """
+    def __init__(self, irf_filename=None, bkg_bintable=None, irf=None):
+        self.irf_filename = None
+        self.irf = None
+        self.bkg_data = None
+
+        # a sort of cache...
+        self.energies = None
+        self.detx = None
+        self.dety = None
+        self.bkg_matrix = None
+        self.bkg_interpolator = None
+
+        if irf_filename is not None:
+            irf = irf_registry.get(irf_filename)
+        if irf is not None:
+            self.irf = irf
+            self.irf_filename = irf.filename
+            self.bkg_data = irf.get_bkg_data()
+        elif bkg_bintable is not None:
+            self.bkg_data = bkg_bintable
+
+        if self.bkg_data is None:
+            raise Exception('Need an irf or background bintable')
+
+        self.get_data_matrices()
+
+    def columns(self):
+        return self.bkg_data.columns
+
+    def data(self):
+        return self.bkg_data.data
+
+    def get_data_matrices(self):
+        """ returns bkg data matrix (energy, dety, detx), energy[LO,HI],
+        detx[LO,HI] and dety[LO,HI]
+        """
+        if self.bkg_matrix is None:
+            data = self.data()
+            self.energies = np.column_stack((data.field('ENERG_LO')[0], data.field('ENERG_HI')[0]))
+            self.detx = np.column_stack((data.field('DETX_LO')[0], data.field('DETX_HI')[0]))
+            self.dety = np.column_stack((data.field('DETY_LO')[0], data.field('DETY_HI')[0]))
+            self.bkg_matrix = data.field('BKG')[0]
+        return self.bkg_matrix, self.energies, self.detx, self.dety
+
+    def get_bkg_interpolator(self):
+        """ returns the linear interpolator over (log10 energy [TeV], dety, detx [deg])
+        """
+        if self.bkg_interpolator is None:
+            bkg_matrix, energy_bins, detx_bins, dety_bins = self.get_data_matrices()
+            grid = (np.mean(np.log10(energy_bins, dtype=float), axis=1), np.mean(dety_bins, axis=1, dtype=float), np.mean(detx_bins, axis=1, dtype=float))
+            self.bkg_interpolator = interpolate.RegularGridInterpolator(grid, np.asarray(bkg_matrix, dtype=float), method='linear', bounds_error=False, fill_value=None)
+        return self.bkg_interpolator
+
+    def eval_rate(self, detx, dety, energy):
+        """
+        return the background rate [1/(MeV s sr)]
+
+        Parameters
+          detx, dety: arrays of detector coordinates [deg]
+          energy: array of energies [TeV]
+
+        Inputs are broadcast together. Outside the grid the nearest grid value
+        is used.
+        """
+        interp_fn = self.get_bkg_interpolator()
+        log_energies, detx, dety = np.broadcast_arrays(np.log10(np.asarray(energy, dtype=float)), np.asarray(detx, dtype=float), np.asarray(dety, dtype=float))
+        points = np.stack([ np.clip(v, g[0], g[-1]) for v, g in zip((log_energies, dety, detx), interp_fn.grid) ], axis=-1)
+        return np.clip(interp_fn(points.reshape(-1, 3)).reshape(detx.shape), 0, None)
+
+    def rate(self, regions, pointing, input_energies, n_energies=20):
+        """
+        return the background rate [counts/s] in circular regions
+
+        Parameters
+          regions: a region { 'ra': ..., 'dec': ..., 'rad': ... } or a list of regions
+          pointing: { 'ra': ..., 'dec': ... }
+          energies: a couple of values in TeV (ex: [ 0.025, 1.0 ])
+          n_energies: integration steps for every unit of log energy
+
+        The rate is integrated over the energy band (trapezoid on E*B(E) over
+        ln E) and averaged on a polar grid of points in each region.
+        """
+        if len(input_energies) != 2:
+            raise Exception('need two energies')
+        single = isinstance(regions, dict)
+        if single:
+            regions = [regions]
+
+        log_energies = np.log10(input_energies)
+        steps = max(int(np.ceil((log_energies[1]-log_energies[0]) * n_energies)), 1) + 1
+        energies = 10**np.linspace(log_energies[0], log_energies[1], steps)
+
+        # detector coordinates [deg] of a polar grid of points with the same
+        # area, one grid for every region scaled by its radius (flat sky
+        # approximation around the region center): shape (regions, points)
+        pnt_ra, pnt_dec = geometry.get_radec(pointing)
+        ras = np.array([ r['ra'] for r in regions ], dtype=float)
+        decs = np.array([ r['dec'] for r in regions ], dtype=float)
+        rads = np.array([ r['rad'] for r in regions ], dtype=float)
+        theta = geometry.separation(pnt_ra, pnt_dec, ras, decs)[:, np.newaxis]
+        pos_angle = np.deg2rad(geometry.position_angle(pnt_ra, pnt_dec, ras, decs))[:, np.newaxis]
+        x, y = sampling.polar_disk(1.0)
+        detx = theta * np.cos(pos_angle) + rads[:, np.newaxis] * x
+        dety = theta * np.sin(pos_angle) + rads[:, np.newaxis] * y
+        # [1/(MeV s sr)], shape (regions, points, energies)
+        bkg_rates = self.eval_rate(detx[..., np.newaxis], dety[..., np.newaxis], energies)
+        # TeV => MeV
+        y = np.mean(bkg_rates, axis=1) * energies * 1e6
+        band_rates = np.sum(np.diff(np.log(energies)) * (y[:, 1:] + y[:, :-1]) / 2, axis=1)
+        solid_angles = 2 * np.pi * (1 - np.cos(np.deg2rad(rads)))
+        rates = band_rates * solid_angles
+        return rates[0] if single else rates
+
+    def counts(self, regions, pointing, input_energies, livetime):
+        """
+        return the expected background counts in circular regions for a
+        livetime [s] (see rate)
+        """
+        return self.rate(regions, pointing, input_energies) * livetime
+
+    def alpha(self, on_region, off_regions, pointing, input_energies):
+        """
+        return the acceptance corrected alpha: the background expected in the on
+        region over the background expected in all the off regions.
+        """
+        if len(off_regions) < 1:
+            raise Exception('need at least 1 off region')
+        return self.rate(on_region, pointing, input_energies) / np.sum(self.rate(off_regions, pointing, input_energies))
+
+def get_irf_zenith(filename):
+    """return the zenith angle [deg] from an irf name (ex: South_z20_average_30m/irf_file.fits => 20)"""
+    found = re.findall(r'(?:^|[_/])z(\d+(?:\.\d+)?)(?=[_/.]|$)', filename)
+    if not found:
+        raise Exception('Cannot find the zenith angle in the irf name {}'.format(filename))
+    return float(found[-1])
+
+class ZenithIRFCube:
+    """Effective area and psf of a family of IRFs at different zenith angles.
+
+    The tables are stacked on a zenith axis and interpolated linearly in
+    cos(zenith), offset and log10 energy. The binning of the first IRF is
+    the reference one, the other IRFs are resampled on it when they differ.
+    Zenith angles outside the family take the nearest IRF values.
+    """
+    def __init__(self, irf_files, zeniths=None):
+        if zeniths is None:
+            zeniths = [ get_irf_zenith(f) for f in irf_files ]
+        if len(zeniths) != len(irf_files):
+            raise Exception('need a zenith angle for every irf file')
+        if len(irf_files) < 2:
+            raise Exception('need at least 2 irf files')
+        if len(set(zeniths)) != len(zeniths):
+            raise Exception('the zenith angles must be different')
+
+        # the interpolation grid needs cos(zenith) increasing
+        order = np.argsort(zeniths)[::-1]
+        self.irf_files = [ irf_files[i] for i in order ]
+        self.zeniths = np.asarray(zeniths, dtype=float)[order]
+        self.irfs = [ irf_registry.get(f) for f in self.irf_files ]
+        self.psf_fields = PSF.fields
+        self.aeff_interpolator = None
+        self.psf_interpolator = None
 
+    @staticmethod
+    def get_cube_interpolator(zeniths, theta_bins, energy_bins, planes):
+        theta_mid  = np.mean(theta_bins, axis=1, dtype=float)
+        energy_mid = np.mean(np.log10(energy_bins, dtype=float), axis=1)
+        cos_zeniths = np.cos(np.deg2rad(zeniths))
+        return interpolate.RegularGridInterpolator((cos_zeniths, theta_mid, energy_mid), np.stack(planes), method='linear', bounds_error=False, fill_value=None)
+
+    @staticmethod
+    def eval_cube_interpolator(interp_fn, zenith, offset, energy):
+        cos_zeniths, theta_mid, energy_mid = interp_fn.grid
+        cos_z, offsets, log_energies = np.broadcast_arrays(np.cos(np.deg2rad(np.asarray(zenith, dtype=float))), utils.get_degrees(offset), np.log10(np.asarray(energy, dtype=float)))
+        points = np.stack([ np.clip(v, g[0], g[-1]) for v, g in zip((cos_z, offsets, log_energies), interp_fn.grid) ], axis=-1)
+        values = interp_fn(points.reshape(-1, 3))
+        return values.reshape(offsets.shape + values.shape[1:])
+
+    def get_aeff_interpolator(self):
+        """returns the interpolator over (cos zenith, offset [deg], log10 energy [TeV])"""
+        if self.aeff_interpolator is None:
+            components = [ irf.effective_area() for irf in self.irfs ]
+            aeff_matrix, energy_bins, theta_bins = components[0].get_data_matrices()
+            theta_mid  = np.mean(theta_bins, axis=1, dtype=float)
+            energy_mid = 10**np.mean(np.log10(energy_bins, dtype=float), axis=1)
+            planes = [ aeff_matrix ] + [ c.get_aeff_2d_log_batch(theta_mid[:, np.newaxis], energy_mid) for c in components[1:] ]
+            self.aeff_interpolator = self.get_cube_interpolator(self.zeniths, theta_bins, energy_bins, planes)
+        return self.aeff_interpolator
+
+    def get_psf_interpolator(self):
+        """returns the interpolator of the psf fields over (cos zenith, offset [deg], log10 energy [TeV])"""
+        if self.psf_interpolator is None:
+            components = [ irf.psf() for irf in self.irfs ]
+            _, energy_bins, theta_bins = components[0].get_data_matrices()
+            psf_matrix = components[0].get_valid_psf_matrix()
+            theta_mid  = np.mean(theta_bins, axis=1, dtype=float)
+            energy_mid = 10**np.mean(np.log10(energy_bins, dtype=float), axis=1)
+            planes = [ np.stack([ psf_matrix[f] for f in self.psf_fields ], axis=-1) ]
+            for c in components[1:]:
+                values = c.get_psf_2d_log(theta_mid[:, np.newaxis], energy_mid)
+                planes.append(np.stack([ values[f] for f in self.psf_fields ], axis=-1))
+            self.psf_interpolator = self.get_cube_interpolator(self.zeniths, theta_bins, energy_bins, planes)
+        return self.psf_interpolator
+
+    def aeff(self, zenith, offset, energy):
+        """
+        return effective area in [m²]
+
+        Parameters
+          zenith: array of zenith angles [deg]
+          offset: array of offsets [deg]
+          energy: array of energies [TeV]
+
+        Inputs are broadcast together.
+        """
+        return self.eval_cube_interpolator(self.get_aeff_interpolator(), zenith, offset, energy)
+
+    def psf(self, zenith, offset, energy):
+        """
+        return psf data array (sigma_1, sigma_2, sigma_3, scale, ampl_2, ampl_3)
+        as a structured array (see PSF.get_psf_2d_log)
+        """
+        stacked = self.eval_cube_interpolator(self.get_psf_interpolator(), zenith, offset, energy)
+        values = np.zeros(stacked.shape[:-1], dtype=[ (f, float) for f in self.psf_fields ])
+        for i, f in enumerate(self.psf_fields):
+            values[f] = stacked[..., i]
+        return values
+
+    def containment(self, zenith, radius, offset, energy):
+        """
+        return the psf fraction inside a radius, one for every zenith angle
+
+        Parameters
+          zenith: array of zenith angles [deg]
+          radius: the region radius [deg]
+          offset: the offset [deg]
+          energy: array of energies [TeV]
+
+        Each IRF gives its own PSF.containment (psf bin values, like
+        EffectiveArea.weighted_aeff_flat_psf_w_powerlaw), then the fractions
+        are interpolated linearly in cos(zenith). The result has shape
+        zenith.shape + energy.shape.
+        """
+        fractions = np.array([ irf.psf().containment(radius, offset, energy) for irf in self.irfs ])
+        cos_zeniths = np.cos(np.deg2rad(self.zeniths))
+        cos_z = np.clip(np.cos(np.deg2rad(np.asarray(zenith, dtype=float))), cos_zeniths[0], cos_zeniths[-1])
+        upper = np.clip(np.searchsorted(cos_zeniths, cos_z, side='right'), 1, len(cos_zeniths) - 1)
+        weights = (cos_z - cos_zeniths[upper - 1]) / (cos_zeniths[upper] - cos_zeniths[upper - 1])
+        weights = weights[..., np.newaxis]
+        return (1 - weights) * fractions[upper - 1] + weights * fractions[upper]
+
+    def weighted_values_for_zeniths(self, region, pointing, input_energies, zeniths, pixel_size=0.05, e_index=-2.4, spectrum=None, flat_psf=True):
+        """return effective area values [m²] for a specific region, one for every zenith angle
+
+        Parameters
+          region:   { 'ra': ..., 'dec': ..., 'rad': ... }
+          pointing: { 'ra': ..., 'dec': ... }
+          energies: a couple of values in TeV (ex: [ 0.025, 1.0 ])
+          zeniths: array of zenith angles [deg], ex: one for every time slice
+          pixel_size: a value in degree (default: 0.05)
+          e_index: is the powerlaw index (default: -2.4)
+          spectrum: a Spectrum or a FileFunction filename, used instead of e_index
+          flat_psf: weight with the psf containment in the region (see
+                    EffectiveArea.weighted_aeff_flat_psf_w_powerlaw)
+
+        The region is sampled once and all the zenith angles are evaluated
+        in a single batch.
+        """
+        if len(input_energies) != 2:
+            raise Exception('need two energies')
+        zeniths = np.asarray(zeniths, dtype=float)
+        energies, energies_middle = EffectiveArea.get_energy_bins(input_energies)
+        i_factor = get_spectrum(e_index if spectrum is None else spectrum).bin_weights(energies)
+        if flat_psf:
+            theta = geometry.coord_separation(pointing, region)
+            i_factor = i_factor * self.containment(zeniths, region['rad'], theta, energies_middle)
+
+        offsets = EffectiveArea.get_region_offsets(region, pointing, pixel_size)
+        # shape (zeniths..., offsets, energies)
+        aeff_values = self.aeff(zeniths[..., np.newaxis, np.newaxis], offsets[:, np.newaxis], energies_middle)
+        return np.sum(np.mean(aeff_values, axis=-2) * i_factor, axis=-1)
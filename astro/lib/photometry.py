@@ -25,14 +25,17 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from astropy.coordinates import SkyCoord, Angle
 from astropy.io import fits
 from astro.lib import utils
+from astro.lib import geometry
+from astro.lib.events import EventsFile, EventStore
 from regions import CircleSkyRegion
 from regions import write_ds9
-import astropy.units as u
 import numpy as np
+from scipy.spatial import cKDTree
 import logging
+import os
+import tempfile
 logging.basicConfig(level=logging.WARN)
 
 # Bintable columns:
@@ -46,20 +49,46 @@ logging.basicConfig(level=logging.WARN)
 #    name = 'MC_ID'; format = '1J'
 
 class Photometrics():
+    # (events x regions) distances computed at once by count_regions
+    distance_chunk_size = 1 << 20
+
     def __init__(self, args):
         self.events_data = None
         self.events_filename = None
         self.mandatory_fields = ['RA', 'DEC', 'ENERGY']
         if 'events_filename' in args:
             self.events_filename = args['events_filename']
-            self.events_data = self.load_data_from_fits_file(self.events_filename)
+            self.events_data = self.load_data_from_fits_file(self.events_filename, args.get('events_columns'), args.get('events_float32', False))
         elif 'events_list' in args:
             self.events_data = args['events_list']
         self.events_list_checks()
         logging.info('Events data type: {}'.format(type(self.events_data)))
+        # events sorted by time once, so a time window is an index range
+        self.events_times = None
+        if 'TIME' in self.events_data.dtype.names:
+            times = self.events_data.field('TIME')
+            if np.any(np.diff(times) < 0):
+                if getattr(self.events_data, 'shm', None) is not None:
+                    logging.warning('The shared events store is not sorted by TIME: each process sorts a private copy. Sort the events before sharing them.')
+                self.events_data = self.events_data[np.argsort(times, kind='stable')]
+            self.events_times = self.events_data.field('TIME')
+        # spatial index over the events directions, built on the first cone query
+        self._events_tree = None
+
+    @property
+    def events_tree(self):
+        """KD-tree of the events unit vectors (see geometry.unit_vectors)"""
+        if self._events_tree is None:
+            self._events_tree = cKDTree(geometry.unit_vectors(self.events_data.field('RA'), self.events_data.field('DEC')))
+        return self._events_tree
+
+    @property
+    def events_vectors(self):
+        """unit vectors of the events, the data of events_tree (not copied)"""
+        return self.events_tree.data
 
     def events_list_checks(self):
-        """Data con be a FITS_rec or a np.recarray
+        """Data con be a FITS_rec, a np.recarray or an EventStore
         see here: https://docs.astropy.org/en/stable/io/fits/usage/table.html
         """
         if self.events_data is None:
@@ -68,77 +97,238 @@ class Photometrics():
             for f in self.mandatory_fields:
                 if f not in self.events_data.columns.names:
                     raise Exception("Events data has no '{}' col".format(f))
-        elif isinstance(self.events_data, np.recarray):
+        elif isinstance(self.events_data, np.recarray) or isinstance(getattr(self.events_data, 'columns', None), dict):
+            # np.recarray or EventStore (imported as lib.events or astro.lib.events)
             for f in self.mandatory_fields:
                 if f not in self.events_data.dtype.names:
                     raise Exception("Events data has no '{}' col".format(f))
         else:
-            raise Exception("Events data must be FITS_rec or np.recarray")
+            raise Exception("Events data must be FITS_rec, np.recarray or EventStore")
 
     @staticmethod
-    def load_data_from_fits_file(filename):
+    def load_data_from_fits_file(filename, columns=None, float32=False):
         """Load events extension data from a fits file.
 
+        The table is memory mapped and only the needed columns are read.
+
         Parameters
         ----------
         filename: str
+        columns: the columns to read (default: RA, DEC, ENERGY and TIME if present)
+        float32: store the float64 columns, but TIME, as float32
 
         Returns
         -------
-        events_bintable data
+        events EventStore
         """
-        hdul = fits.open(filename)
-        # hdul.info()
-        events_bintable = hdul['EVENTS']
-        data = events_bintable.data
-        hdul.close()
-        return data
+        if columns is None:
+            names = EventsFile(filename).names
+            columns = [ c for c in ['RA', 'DEC', 'ENERGY', 'TIME'] if c in names ]
+        return EventStore.from_file(filename, columns, float32)
 
-    def region_counter(self, input_center, input_radius, emin=None, emax=None, tmin=None, tmax=None):
-        """Counts photons in an input area"""
-        region_center = utils.get_skycoord(input_center)
-        region_radius = utils.get_angle(input_radius)
-        #print(f"input_center: {input_center}")
-        #print(f"input_radius: {input_radius}")
-        #print(f"region_center: {region_center}")
-        #print(f"region_radius: {region_radius}")
+    @classmethod
+    def from_gammalib(cls, obs_list, columns=('RA', 'DEC', 'ENERGY', 'TIME', 'MC_ID'), float32=False):
+        """Build a Photometrics from the events of gammalib observations.
 
-        # filtering...
-        condlist = np.full(len(self.events_data.field('ENERGY')), True)
-        #print("condlist: ",len([i for i in condlist if i]))
+        The events lists are written by gammalib as fits tables and read
+        back column by column (see EventsFile), then the observations are
+        concatenated: there is no work per event in python.
 
-        # ... w/ energy boundaries
-        if emin is not None:
-            condlist &= self.events_data.field('ENERGY') >= emin
-        if emax is not None:
-            condlist &= self.events_data.field('ENERGY') <= emax
-        #print("condlist: ",len([i for i in condlist if i]))
+        Parameters
+        ----------
+        obs_list: gammalib.GObservations (or a list of observations)
+        columns: the columns to keep, the optional ones (TIME, MC_ID) are
+            skipped if an observation has not them
+        float32: store the float64 columns, but TIME, as float32
 
+        Returns
+        -------
+        Photometrics, None if the observations have no events
+        """
+        import gammalib
+        data = []
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for i, obs in enumerate(obs_list):
+                filename = os.path.join(tmp_dir, 'events_{}.fits'.format(i))
+                events_fits = gammalib.GFits()
+                obs.events().write(events_fits)
+                events_fits.saveto(filename, True)
+                events_fits.close()
+                events_file = EventsFile(filename)
+                # RA, DEC and ENERGY are mandatory: check_columns raises if missing
+                names = [ c for c in columns if c in events_file.names or c in ('RA', 'DEC', 'ENERGY') ]
+                # get_column copies the values, so they outlive the temporary file
+                data.append(events_file.read(names))
+        if sum(len(d['RA']) for d in data) == 0:
+            return None
+        names = [ c for c in columns if all(c in d for d in data) ]
+        events = EventStore({ c: np.concatenate([ d[c] for d in data ]).astype(EventStore.get_column_dtype(c, data[0][c].dtype, float32), copy=False) for c in names })
+        return cls({ 'events_list': events })
+
+    @staticmethod
+    def stream_count_regions(filename, regions, emin=None, emax=None, tmin=None, tmax=None, chunk_size=1000000):
+        """Counts photons in many regions reading the events file in chunks.
+
+        The memory use depends on chunk_size, not on the file size, so files
+        larger than the memory can be counted. The boundaries are the same of
+        count_regions.
+
+        Returns
+        -------
+        array of counts, one for each region
+        """
+        events_file = EventsFile(filename)
+        columns = [ 'RA', 'DEC' ]
+        if emin is not None or emax is not None:
+            columns.append('ENERGY')
+        if tmin is not None or tmax is not None:
+            columns.append('TIME')
+        centers = geometry.unit_vectors([ r['ra'] for r in regions ], [ r['dec'] for r in regions ])
+        chords = geometry.chord([ utils.get_degrees(r['rad']) for r in regions ])
+        counts = np.zeros(len(regions), dtype=int)
+        for chunk in events_file.chunks(columns, chunk_size):
+            condlist = np.full(len(chunk['RA']), True)
+            for field, vmin, vmax in [ ('ENERGY', emin, emax), ('TIME', tmin, tmax) ]:
+                if vmin is not None:
+                    condlist &= chunk[field] >= vmin
+                if vmax is not None:
+                    condlist &= chunk[field] <= vmax
+            vectors = geometry.unit_vectors(chunk['RA'][condlist], chunk['DEC'][condlist])
+            for i in range(len(regions)):
+                counts[i] += np.count_nonzero(np.linalg.norm(vectors - centers[i], axis=1) < chords[i])
+        return counts
+
+    def cone_indices(self, input_center, input_radius):
+        """Return the sorted indices of the events closer than radius to center.
+
+        The KD-tree is queried with the chord of the radius, so only the
+        events near the cone are visited.
+        """
+        center_vector = geometry.unit_vectors(*geometry.get_radec(input_center))
+        chord = geometry.chord(utils.get_degrees(input_radius))
+        # a bit of margin on the query, the boundary is checked exactly below
+        candidates = np.asarray(self.events_tree.query_ball_point(center_vector, chord * (1 + 1e-9) + 1e-15), dtype=int)
+        candidates.sort()
+        distances = np.linalg.norm(self.events_vectors[candidates] - center_vector, axis=1)
+        return candidates[distances < chord]
+
+    def get_time_range(self, tmin=None, tmax=None):
+        """Return the (start, stop) indices of the events with tmin <= TIME <= tmax.
+
+        The events are sorted by time, so the search is O(log n).
+        """
+        if self.events_times is None:
+            raise Exception("Events data has no 'TIME' col")
         # FIXME: TIME needs a better implementation
         # atm it consider users that knows the time format in the input fits
-        if tmin is not None:
-            condlist &= self.events_data.field('TIME') >= tmin
-        if tmax is not None:
-            condlist &= self.events_data.field('TIME') <= tmax
+        start = 0 if tmin is None else int(np.searchsorted(self.events_times, tmin, side='left'))
+        stop = len(self.events_times) if tmax is None else int(np.searchsorted(self.events_times, tmax, side='right'))
+        return start, max(start, stop)
 
-        #print("condlist: ",len([i for i in condlist if i]))
-        events_list = np.extract(condlist, self.events_data)
+    def time_window(self, tmin=None, tmax=None):
+        """Return the events with tmin <= TIME <= tmax, as a view of the events data"""
+        start, stop = self.get_time_range(tmin, tmax)
+        return self.events_data[start:stop]
 
-        #print("events_list: ",events_list)
-        #print("events_list: ",len(events_list))
+    def get_events_mask(self, emin=None, emax=None, tmin=None, tmax=None, indices=None):
+        """Return the mask of the events within the energy and time boundaries.
 
-        # events coordinates from the selected events list
-        events_coords = SkyCoord(events_list.field('RA'), events_list.field('DEC'), unit='deg', frame='icrs')
-        distances = region_center.separation(events_coords)
+        With indices, only those events are checked and the mask is over them.
+        """
+        start, stop = 0, len(self.events_data)
+        if tmin is not None or tmax is not None:
+            start, stop = self.get_time_range(tmin, tmax)
 
-        #print(f"events_coords: {events_coords[0:2]} distances: {distances[0:2]} region_radius: {region_radius}")
-        #print("distances: ",len(distances))
-        #print("region_radius: ",region_radius)
-        #print("istances < region_radius: ",np.count_nonzero(distances < region_radius))
+        if indices is None:
+            condlist = np.full(len(self.events_data), False)
+            window = slice(start, stop)
+            # a view over the time window: the updates go in condlist
+            selected = condlist[window]
+            selected[:] = True
+        else:
+            condlist = (indices >= start) & (indices < stop)
+            window = indices
+            selected = condlist
 
-        #print("istances >= region_radius: ",np.count_nonzero(distances >= region_radius))
+        # ... w/ energy boundaries
+        if emin is not None or emax is not None:
+            energies = self.events_data.field('ENERGY')[window]
+            if emin is not None:
+                selected &= energies >= emin
+            if emax is not None:
+                selected &= energies <= emax
+        return condlist
 
-        return np.count_nonzero(distances < region_radius)
+    def region_counter(self, input_center, input_radius, emin=None, emax=None, tmin=None, tmax=None):
+        """Counts photons in an input area"""
+        ra, dec = geometry.get_radec(input_center)
+        region = { 'ra': ra, 'dec': dec, 'rad': utils.get_degrees(input_radius) }
+        return self.count_regions([region], emin=emin, emax=emax, tmin=tmin, tmax=tmax)[0]
+
+    def count_regions(self, regions, emin=None, emax=None, tmin=None, tmax=None):
+        """Counts photons in many regions at once.
+
+        Parameters
+        ----------
+        regions: list of { 'ra': ..., 'dec': ..., 'rad': ... }
+        emin, emax, tmin, tmax: the events boundaries, as in region_counter
+
+        Returns
+        -------
+        array of counts, one for each region
+        """
+        if len(regions) < 1:
+            return np.zeros(0, dtype=int)
+        centers = geometry.unit_vectors([ r['ra'] for r in regions ], [ r['dec'] for r in regions ])
+        chords = geometry.chord([ utils.get_degrees(r['rad']) for r in regions ])
+        if tmin is not None or tmax is not None:
+            start, stop = self.get_time_range(tmin, tmax)
+            # narrow time window: testing the window events against every
+            # region costs less than collecting the events of the cones (or
+            # than building the spatial index, if it is not there yet)
+            if self._events_tree is None:
+                cones_cost = len(self.events_data)
+            else:
+                cones_cost = np.sum(self.events_tree.query_ball_point(centers, chords * (1 + 1e-9) + 1e-15, return_length=True))
+            if (stop - start) * len(regions) < cones_cost:
+                condlist = self.get_events_mask(emin, emax, indices=np.arange(start, stop))
+                vectors = geometry.unit_vectors(self.events_data.field('RA')[start:stop][condlist], self.events_data.field('DEC')[start:stop][condlist])
+                counts = np.zeros(len(regions), dtype=int)
+                # chunks of rows bound the (rows, regions, 3) temporary to ~24 MB
+                chunk_size = max(1, self.distance_chunk_size // len(regions))
+                for i in range(0, len(vectors), chunk_size):
+                    inside = np.linalg.norm(vectors[i:i+chunk_size, np.newaxis, :] - centers, axis=2) < chords
+                    counts += np.count_nonzero(inside, axis=0)
+                return counts
+        indices, region_ids = self.region_members(regions)
+        # the events of all the regions are filtered at once
+        condlist = self.get_events_mask(emin, emax, tmin, tmax, indices=indices)
+        return np.bincount(region_ids[condlist], minlength=len(regions))
+
+    def region_members(self, regions):
+        """Return the (indices, region ids) couples of the events inside each region.
+
+        An event inside two overlapping regions is returned twice.
+        """
+        centers = geometry.unit_vectors([ r['ra'] for r in regions ], [ r['dec'] for r in regions ])
+        chords = geometry.chord([ utils.get_degrees(r['rad']) for r in regions ])
+        candidates = [ np.asarray(c, dtype=int) for c in self.events_tree.query_ball_point(centers, chords * (1 + 1e-9) + 1e-15) ]
+        indices = np.concatenate(candidates)
+        region_ids = np.repeat(np.arange(len(regions)), [ len(c) for c in candidates ])
+        inside = np.linalg.norm(self.events_vectors[indices] - centers[region_ids], axis=1) < chords[region_ids]
+        return indices[inside], region_ids[inside]
+
+    def count_cube(self, regions, time_edges, energy_edges, labels=None):
+        """Return a RegionCountCube of the regions, see RegionCountCube
+
+        With labels (see label_regions) regions can be None: the labelled
+        regions are used.
+        """
+        return RegionCountCube(self, regions, time_edges, energy_edges, labels)
+
+    def label_regions(self, regions):
+        """Return the RegionLabels of the regions, see RegionLabels"""
+        return RegionLabels(self, regions)
 
     @classmethod
     def reflected_regions(cls, input_pointing_center, input_region_center, input_region_radius):
@@ -154,13 +344,13 @@ class Photometrics():
         -------
         array of regions
         """
-        pointing_center = utils.get_skycoord(input_pointing_center)
-        region_center = utils.get_skycoord(input_region_center)
-        region_radius = utils.get_angle(input_region_radius)
+        pnt_ra, pnt_dec = geometry.get_radec(input_pointing_center)
+        region_center = geometry.get_radec(input_region_center)
+        region_radius = float(utils.get_degrees(input_region_radius))
 
         # Angular separation of reflected regions. 1.05 factor is to have a margin
         region_diameter = 1.05 * 2.0 * region_radius
-        radius = pointing_center.separation(region_center)
+        radius = geometry.separation(pnt_ra, pnt_dec, *region_center)
         # the numbers_of_reflected regions is the number of center that can stay
         # on the circumference, NOT the really computated number of regions.
         # the number is floor down
@@ -169,16 +359,13 @@ class Photometrics():
         # need at least 4 centers to get one off region.
         if numbers_of_reflected_regions < 4:
             raise Exception('the combination of region radius and coordinates does not allow to compute reflected regions.')
-        regions_offset_angle = Angle(360, unit='deg') / numbers_of_reflected_regions
+        regions_offset_angle = 360.0 / numbers_of_reflected_regions
 
-        regions = []
         # starting from the source region 0, we skip region 1 and region N, so 2..N-1
-        starting_pos_angle = pointing_center.position_angle(region_center)
-        for i in range(2, numbers_of_reflected_regions-1):
-            theta = starting_pos_angle + i * regions_offset_angle
-            coord_pos = pointing_center.directional_offset_by(theta, radius)
-            regions.append({ 'ra': coord_pos.ra.deg, 'dec': coord_pos.dec.deg, 'rad': region_radius.deg })
-        return regions
+        starting_pos_angle = geometry.position_angle(pnt_ra, pnt_dec, *region_center)
+        thetas = starting_pos_angle + np.arange(2, numbers_of_reflected_regions-1) * regions_offset_angle
+        regions_ra, regions_dec = geometry.offset_by(pnt_ra, pnt_dec, thetas, radius)
+        return [ { 'ra': ra, 'dec': dec, 'rad': region_radius } for ra, dec in zip(regions_ra, regions_dec) ]
 
     @classmethod
     def wobble_regions(cls, *args):
@@ -199,17 +386,14 @@ class Photometrics():
         array of regions
         """
         # FIXME Wobble algorithm has no check about distance and region radius.
-        pointing_center = utils.get_skycoord(input_pointing_center)
-        region_center = utils.get_skycoord(input_region_center)
-        region_radius = utils.get_angle(input_region_radius)
-        radius = pointing_center.separation(region_center)
-        starting_pos_angle = pointing_center.position_angle(region_center)
-        regions = []
-        for i in range(1,4):
-            theta = starting_pos_angle + i * Angle(90, unit='deg')
-            coord_pos = pointing_center.directional_offset_by(theta, radius)
-            regions.append({ 'ra': coord_pos.ra.deg, 'dec': coord_pos.dec.deg, 'rad': region_radius.deg })
-        return regions
+        pnt_ra, pnt_dec = geometry.get_radec(input_pointing_center)
+        region_center = geometry.get_radec(input_region_center)
+        region_radius = float(utils.get_degrees(input_region_radius))
+        radius = geometry.separation(pnt_ra, pnt_dec, *region_center)
+        starting_pos_angle = geometry.position_angle(pnt_ra, pnt_dec, *region_center)
+        thetas = starting_pos_angle + np.arange(1, 4) * 90.0
+        regions_ra, regions_dec = geometry.offset_by(pnt_ra, pnt_dec, thetas, radius)
+        return [ { 'ra': ra, 'dec': dec, 'rad': region_radius } for ra, dec in zip(regions_ra, regions_dec) ]
 
     @classmethod
     def write_region(cls, coords, filename, **kwargs):
@@ -224,3 +408,123 @@ class Photometrics():
             circles.append(CircleSkyRegion(center=center, radius=rad, visual=kwargs))
         write_ds9(circles, filename)
 
+class RegionCountCube():
+    """Cumulative counts of some regions over (time, energy) edges.
+
+    The cubes are built with one pass over the events in the regions. The
+    counts with tmin <= TIME <= tmax and emin <= ENERGY <= emax, where the
+    boundaries are edges (or None), are then answered by inclusion-exclusion
+    in O(1). Other boundaries are counted exactly on the events.
+    """
+    def __init__(self, photometrics, regions, time_edges, energy_edges, labels=None):
+        if photometrics.events_times is None:
+            raise Exception("Events data has no 'TIME' col")
+        if labels is not None:
+            if regions is None:
+                regions = labels.regions
+            elif list(regions) != labels.regions:
+                raise Exception('the regions are not the labelled ones')
+        self.photometrics = photometrics
+        self.regions = list(regions)
+        self.time_edges = np.asarray(time_edges, dtype=float)
+        self.energy_edges = np.asarray(energy_edges, dtype=float)
+        for edges in [self.time_edges, self.energy_edges]:
+            if np.any(np.diff(edges) <= 0):
+                raise Exception('the edges must be increasing')
+
+        # with the labels the regions membership is not computed again
+        self.labels = labels
+        if labels is None:
+            indices, region_ids = photometrics.region_members(self.regions)
+        else:
+            indices, region_ids = labels.indices, labels.region_ids
+        times = photometrics.events_times[indices]
+        energies = photometrics.events_data.field('ENERGY')[indices]
+        # value < edges[i] for i >= start 'lt', value <= edges[i] for i >= start 'le'
+        time_starts = { 'lt': np.searchsorted(self.time_edges, times, side='right'),
+                        'le': np.searchsorted(self.time_edges, times, side='left') }
+        energy_starts = { 'lt': np.searchsorted(self.energy_edges, energies, side='right'),
+                          'le': np.searchsorted(self.energy_edges, energies, side='left') }
+        # the last index is over all the edges: every event is counted
+        shape = (len(self.regions), len(self.time_edges)+1, len(self.energy_edges)+1)
+        self.cubes = {}
+        for t_kind, t_starts in time_starts.items():
+            for e_kind, e_starts in energy_starts.items():
+                flat = np.ravel_multi_index((region_ids, t_starts, e_starts), shape)
+                histogram = np.bincount(flat, minlength=np.prod(shape)).reshape(shape)
+                self.cubes[(t_kind, e_kind)] = histogram.cumsum(axis=1).cumsum(axis=2)
+
+    @staticmethod
+    def get_edge_index(edges, value):
+        """Return the index of value in the edges, len(edges) for None or -1 if it is not an edge"""
+        if value is None:
+            return len(edges)
+        i = int(np.searchsorted(edges, value))
+        if i < len(edges) and edges[i] == value:
+            return i
+        return -1
+
+    def counts(self, tmin=None, tmax=None, emin=None, emax=None):
+        """Return the counts of each region within the time and energy boundaries."""
+        for vmin, vmax in [ (tmin, tmax), (emin, emax) ]:
+            if vmin is not None and vmax is not None and vmin > vmax:
+                # empty window: the inclusion-exclusion would be negative
+                return np.zeros(len(self.regions), dtype=int)
+        t_lo, t_hi = self.get_edge_index(self.time_edges, tmin), self.get_edge_index(self.time_edges, tmax)
+        e_lo, e_hi = self.get_edge_index(self.energy_edges, emin), self.get_edge_index(self.energy_edges, emax)
+        if min(t_lo, t_hi, e_lo, e_hi) < 0:
+            # the boundaries are not on the edges
+            if self.labels is not None:
+                return self.labels.counts(tmin=tmin, tmax=tmax, emin=emin, emax=emax)
+            return self.photometrics.count_regions(self.regions, emin=emin, emax=emax, tmin=tmin, tmax=tmax)
+
+        def cumulative(t_kind, t_index, e_kind, e_index):
+            # a missing lower boundary excludes nothing
+            if t_index is None or e_index is None:
+                return 0
+            return self.cubes[(t_kind, e_kind)][:, t_index, e_index]
+        t_lo = None if tmin is None else t_lo
+        e_lo = None if emin is None else e_lo
+        return (cumulative('le', t_hi, 'le', e_hi) - cumulative('lt', t_lo, 'le', e_hi)
+                - cumulative('le', t_hi, 'lt', e_lo) + cumulative('lt', t_lo, 'lt', e_lo))
+
+class RegionLabels():
+    """Region labels of the events, for many counts over the same regions.
+
+    The events inside the regions are labelled with the index of their
+    region, so with the on region first and then the off regions the label
+    is 0 for on and i for the off region i. The spatial queries are done
+    once: the counts with tmin <= TIME <= tmax and emin <= ENERGY <= emax
+    are then a bincount of the labels of the events in the boundaries.
+
+    An event inside overlapping regions has a label for each of them, so
+    the counts are the same of count_regions.
+    """
+    def __init__(self, photometrics, regions):
+        self.photometrics = photometrics
+        self.regions = list(regions)
+        self.indices = np.zeros(0, dtype=int)
+        self.region_ids = np.zeros(0, dtype=int)
+        if len(self.regions) > 0:
+            indices, region_ids = photometrics.region_members(self.regions)
+            # the (event, region) couples sorted by event index (so by time if TIME exists)
+            order = np.argsort(indices, kind='stable')
+            self.indices, self.region_ids = indices[order], region_ids[order]
+
+    def counts(self, tmin=None, tmax=None, emin=None, emax=None):
+        """Return the counts of each region within the time and energy boundaries."""
+        indices, region_ids = self.indices, self.region_ids
+        if tmin is not None or tmax is not None:
+            # the time window is an index range: the members in it are a slice
+            start, stop = self.photometrics.get_time_range(tmin, tmax)
+            lo, hi = np.searchsorted(indices, [start, stop])
+            indices, region_ids = indices[lo:hi], region_ids[lo:hi]
+        if emin is not None or emax is not None:
+            energies = self.photometrics.events_data.field('ENERGY')[indices]
+            condlist = np.full(len(indices), True)
+            if emin is not None:
+                condlist &= energies >= emin
+            if emax is not None:
+                condlist &= energies <= emax
+            region_ids = region_ids[condlist]
+        return np.bincount(region_ids, minlength=len(self.regions))
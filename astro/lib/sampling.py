@@ -0,0 +1,144 @@
+# Copyright 2019,2020 Simone Tampieri
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import numpy as np
+
+# Region sampling as numpy arrays.
+# The samplers return tangent plane offsets (x toward east, y toward north, in
+# degree) from the region center; to_sky moves them on the sky.
+
+GOLDEN_ANGLE = np.pi * (3 - np.sqrt(5))
+
+def check_region(region):
+    for k in ['ra', 'dec', 'rad']:
+        if k in region:
+            continue
+        raise Exception('region data missing {} mandatory key.'.format(k))
+    if region['rad'] <= 0:
+        raise Exception('region radius must be > 0')
+
+def grid_disk(rad, pixel_size):
+    """
+    return the middle points (x, y) [deg] of a square grid of pixels on the
+    tangent plane, inside a disk of radius rad [deg]
+    """
+    if pixel_size <= 0:
+        raise Exception('pixel side must be > 0')
+    n_pixel_on_axis = max(int(np.ceil(rad / pixel_size)), 1)
+    steps = np.arange(-n_pixel_on_axis, n_pixel_on_axis+1) * pixel_size
+    x, y = np.meshgrid(steps, steps)
+    inside = np.hypot(x, y) < rad
+    if not np.any(inside):
+        # pixel larger than the region, keep the center
+        inside = (x == 0) & (y == 0)
+    return x[inside], y[inside]
+
+def polar_disk(rad, n_radius=10, n_angle=36):
+    """
+    return a polar grid of points (x, y) [deg] in a disk of radius rad [deg],
+    each one with the same area.
+    """
+    # middle points of equal area rings
+    radii = rad * np.sqrt((np.arange(n_radius) + 0.5) / n_radius)
+    angles = 2 * np.pi * (np.arange(n_angle) + 0.5) / n_angle
+    x = (radii[:, np.newaxis] * np.cos(angles)).ravel()
+    y = (radii[:, np.newaxis] * np.sin(angles)).ravel()
+    return x, y
+
+def fibonacci_disk(rad, n):
+    """
+    return n points (x, y) [deg] of a Fibonacci (sunflower) pattern in a disk
+    of radius rad [deg]. Every point covers the same area.
+    """
+    if n < 1:
+        raise Exception('need at least 1 point')
+    k = np.arange(n)
+    radii = rad * np.sqrt((k + 0.5) / n)
+    angles = k * GOLDEN_ANGLE
+    return radii * np.cos(angles), radii * np.sin(angles)
+
+def to_sky(center, x, y):
+    """
+    return (ra, dec) [deg] of tangent plane offsets (x, y) [deg] around the
+    center (gnomonic projection, so the cos(dec) squeeze of the ra axis is
+    accounted)
+    """
+    ra0 = np.deg2rad(float(center['ra']))
+    dec0 = np.deg2rad(float(center['dec']))
+    xi = np.tan(np.deg2rad(np.asarray(x, dtype=float)))
+    eta = np.tan(np.deg2rad(np.asarray(y, dtype=float)))
+    denom = np.cos(dec0) - eta * np.sin(dec0)
+    ra = ra0 + np.arctan2(xi, denom)
+    dec = np.arctan2(np.sin(dec0) + eta * np.cos(dec0), np.hypot(xi, denom))
+    return np.rad2deg(ra) % 360, np.rad2deg(dec)
+
+def region_samples(region, pixel_size=0.05, method='grid', n=None):
+    """
+    return (ra, dec) arrays [deg] of sample points in a circular region
+
+    Parameters
+      region: { 'ra': ..., 'dec': ..., 'rad': ... }
+      pixel_size: grid step in degree, for the grid method (default: 0.05)
+      method: 'grid' (tangent plane pixels), 'polar' or 'fibonacci'
+      n: number of points for the fibonacci method (default: the region
+         area over the pixel area)
+    """
+    check_region(region)
+    rad = float(region['rad'])
+    if method == 'grid':
+        x, y = grid_disk(rad, pixel_size)
+    elif method == 'polar':
+        x, y = polar_disk(rad)
+    elif method == 'fibonacci':
+        if n is None:
+            n = max(int(np.pi * rad**2 / pixel_size**2), 1)
+        x, y = fibonacci_disk(rad, n)
+    else:
+        raise Exception('invalid region sampling method')
+    return to_sky(region, x, y)
+
+def adaptive_region_mean(fn, region, rtol=1e-3, n_start=64, n_max=2**16):
+    """
+    return the mean of fn over a circular region and its error estimate
+
+    fn takes the (ra, dec) arrays of the points and returns an array with the
+    points on the first axis; the mean is over that axis. The Fibonacci
+    sampling doubles the points until two estimates differ less than
+    rtol (relative), the error is that difference. The cost depends on the
+    accuracy, not on the region size.
+    """
+    check_region(region)
+    rad = float(region['rad'])
+    n = n_start
+    previous = np.mean(fn(*to_sky(region, *fibonacci_disk(rad, n))), axis=0)
+    while True:
+        n *= 2
+        current = np.mean(fn(*to_sky(region, *fibonacci_disk(rad, n))), axis=0)
+        error = np.abs(current - previous)
+        if np.all(error <= rtol * np.abs(current)) or n >= n_max:
+            return current, error
+        previous = current
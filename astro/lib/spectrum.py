@@ -0,0 +1,142 @@
+# Copyright 2019,2020 Simone Tampieri
+# 
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the copyright holder nor the names of its contributors
+# may be used to endorse or promote products derived from this software without
+# specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+from abc import ABC, abstractmethod
+import hashlib
+import numbers
+import numpy as np
+
+class Spectrum(ABC):
+    """Base class for the spectral models used to weight energy bins.
+
+    Subclasses implement integral(edges) returning the spectrum integral
+    inside each bin; energies are in TeV.
+    """
+    @abstractmethod
+    def integral(self, edges):
+        pass
+
+    def bin_weights(self, edges):
+        """Return the fraction of the spectrum integral in each bin.
+
+        Parameters
+          edges: N+1 bin edges in TeV
+
+        The weights sum to 1 over the range [ edges[0], edges[-1] ].
+        """
+        partials = self.integral(np.asarray(edges, dtype=float))
+        total = np.sum(partials)
+        if total <= 0:
+            raise Exception('The spectrum integral in the energy range is not positive')
+        return partials / total
+
+    @abstractmethod
+    def signature(self):
+        """Return a json serializable identifier (useful as cache key)."""
+        pass
+
+class PowerLaw(Spectrum):
+    """Power law spectrum prefactor * (E/pivot)^index. Bin integrals are analytic.
+
+    Parameters
+      index: the powerlaw index (default: -2.4)
+      prefactor: differential flux at pivot energy (default: 1.0, ex: ph/cm²/s/TeV)
+      pivot: the pivot energy in TeV (default: 1.0)
+    """
+    def __init__(self, index=-2.4, prefactor=1.0, pivot=1.0):
+        self.index = float(index)
+        self.prefactor = float(prefactor)
+        self.pivot = float(pivot)
+
+    def integral(self, edges):
+        edges = np.asarray(edges, dtype=float) / self.pivot
+        if np.isclose(self.index, -1.0):
+            return self.prefactor * self.pivot * np.diff(np.log(edges))
+        k = self.index + 1.0
+        return self.prefactor * self.pivot * np.diff(edges**k) / k
+
+    def signature(self):
+        return ['PowerLaw', self.index, self.prefactor, self.pivot]
+
+class TabulatedSpectrum(Spectrum):
+    """Spectrum known on a set of nodes.
+
+    Parameters
+      energies: nodes in TeV
+      values: differential flux in any unit per TeV
+
+    Bin integrals use the trapezoid rule on E*f(E) over ln(E), with the bin
+    edges inserted among the nodes. Outside the nodes the spectrum is zero.
+    """
+    def __init__(self, energies, values):
+        energies = np.asarray(energies, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if energies.shape != values.shape or energies.ndim != 1 or len(energies) < 2:
+            raise Exception('Need the same number (>= 2) of energies and values')
+        order = np.argsort(energies)
+        self.energies = energies[order]
+        self.values = values[order]
+
+    @classmethod
+    def from_file_function(cls, filename):
+        """Load a FileFunction spectrum (see TimeSliceExporter).
+
+        The file has two space separated columns: energy [MeV] and
+        differential flux [ph/cm²/s/MeV].
+        """
+        data = np.loadtxt(filename, ndmin=2)
+        # MeV => TeV, ph/cm²/s/MeV => ph/cm²/s/TeV
+        return cls(data[:, 0] * 1e-6, data[:, 1] * 1e6)
+
+    def integral(self, edges):
+        log_nodes = np.log(self.energies)
+        # the spectrum is zero outside the nodes: the bins are cut to the
+        # nodes range (a bin outside it has zero width)
+        log_edges = np.clip(np.log(np.asarray(edges, dtype=float)), log_nodes[0], log_nodes[-1])
+        grid = np.union1d(log_nodes, log_edges)
+        y = np.interp(grid, log_nodes, self.values * self.energies)
+        cumulative = np.concatenate(([0.0], np.cumsum(np.diff(grid) * (y[1:] + y[:-1]) / 2)))
+        return np.diff(cumulative[np.searchsorted(grid, log_edges)])
+
+    def signature(self):
+        digest = hashlib.sha256()
+        digest.update(self.energies.tobytes())
+        digest.update(self.values.tobytes())
+        return ['TabulatedSpectrum', digest.hexdigest()]
+
+def get_spectrum(input_spectrum):
+    spec = None
+    if isinstance(input_spectrum, Spectrum):
+        spec = input_spectrum
+    elif isinstance(input_spectrum, numbers.Real) and not isinstance(input_spectrum, (bool, np.bool_)):
+        # python and numpy scalars
+        spec = PowerLaw(input_spectrum)
+    elif isinstance(input_spectrum, str):
+        spec = TabulatedSpectrum.from_file_function(input_spectrum)
+    else:
+        raise Exception('The input parameter must be a Spectrum, a power law index or a FileFunction filename.')
+    return spec
@@ -28,6 +28,7 @@
 
 import csv
 import math
+import numpy as np
 from astropy.coordinates import SkyCoord, Angle
 
 def li_ma (n_on, n_off, alpha):
@@ -44,6 +45,13 @@ def li_ma (n_on, n_off, alpha):
     fullb   = first + second
     return math.sqrt(2) * math.sqrt(fullb)
 
+def poisson_significance(n_on, mu_b):
+    """Significance of n_on counts over a known background mu_b (Li & Ma with alpha -> 0)"""
+    if n_on <= 0 or mu_b <= 0:
+        return None
+    s2 = 2 * (n_on * math.log(n_on / mu_b) - (n_on - mu_b))
+    return math.copysign(math.sqrt(max(s2, 0)), n_on - mu_b)
+
 def read_timeslices_tsv(filename):
     ts = []
     with open(filename, mode='r', newline='\n') as fh:
@@ -63,6 +71,12 @@ def get_angle(input_angle):
         raise Exception('The input parameter must be an Angle or a float for decimal degree.')
     return ang
 
+def get_degrees(input_angle):
+    """Return decimal degree values as a float array from an Angle, a float or an array of floats."""
+    if isinstance(input_angle, Angle):
+        return np.asarray(input_angle.degree, dtype=float)
+    return np.asarray(input_angle, dtype=float)
+
 def get_skycoord(pnt_coord):
     coord = None
     if isinstance(pnt_coord, SkyCoord):
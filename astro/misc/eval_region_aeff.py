@@ -1,4 +1,5 @@
-from lib.irf import EffectiveArea
+from lib.irf import irf_registry
+from lib.batch import evaluate_aeff_batch
 from lib import utils
 from astropy.coordinates import SkyCoord
 import sys
@@ -103,12 +104,9 @@ def get_thetas(pointing, midpoints):
     return [ ang.degree for ang in pnt.separation(midpoints_coords) ]
     
 def eval_aeff(irf_filename, thetas, energy):
-    aeff = EffectiveArea(irf_filename=irf_filename)
-    n_points = len(thetas)
-    val = 0
-    for t in thetas:
-        val += aeff.get_aeff_2d_log(t, energy) / n_points
-    return val
+    # the irf is loaded once and shared between the calls
+    aeff = irf_registry.get(irf_filename).effective_area()
+    return np.mean(aeff.get_aeff_2d_log_batch(thetas, energy))
 
 if __name__ == '__main__':
     irf_filename = sys.argv[1]
@@ -134,6 +132,11 @@ if __name__ == '__main__':
             aeff_val = eval_aeff(irf_filename, offsets, en)
             print('Effective area ({0:7.3f} TeV): {1:.5e} cm²'.format(en, aeff_val*1e4))
 
+    # compare all the irf files given on the command line
+    bands = [ [0.025, 1.0], [1.0, 150.0] ]
+    for row in evaluate_aeff_batch(sys.argv[1:], [source_region], [pointing], bands):
+        print('{irf}: region Aeff ({emin:7.3f}-{emax:7.3f} TeV): {aeff:.5e} cm²'.format(**row))
+
 
 
 
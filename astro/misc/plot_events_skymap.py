@@ -1,20 +1,17 @@
 import argparse
-from astropy.io import fits
+from lib.events import EventsFile
 import matplotlib.pyplot as plt
 
 def get_events_from_file(input_filename):
-    hdul = fits.open(input_filename)
-    events_bintable = hdul['EVENTS']
-    data = events_bintable.data
-    hdul.close()
-    return data
+    # memory mapped, only the plotted columns are read
+    return EventsFile(input_filename).read(['TIME', 'RA', 'DEC', 'ENERGY'])
 
 
 def data_selection(events):
-    t   = events.field('TIME')
-    ra  = events.field('RA')
-    dec = events.field('DEC')
-    ene = events.field('ENERGY')
+    t   = events['TIME']
+    ra  = events['RA']
+    dec = events['DEC']
+    ene = events['ENERGY']
     ret = { "time":t, "ra":ra, "dec":dec, "ene":ene }
     return ret
 
@@ -1,4 +1,5 @@
-from lib.irf_aeff import EffectiveArea
+from lib.cache import DiskCache
+from lib.irf import EffectiveArea
 from lib.photometry import Photometrics
 from lib.utils import li_ma
 import argparse
@@ -31,18 +32,18 @@ def counting(filename, pnt, source, rad):
         phm.write_region(off_regions,    os.path.join(tmp_dir, 'off.reg'), color='red',   dash=True, width=2)
 
     # counting!!
-    on_count = phm.region_counter(source, rad)
-    off_count = 0
-    for r in off_regions:
-        off_count += phm.region_counter(r, r['rad'])
+    counts = phm.count_regions([source_w_rad] + off_regions)
+    on_count = counts[0]
+    off_count = np.sum(counts[1:])
     alpha = 1/len(off_regions)
     excess = on_count - alpha * off_count
     signif = li_ma(on_count, off_count, alpha)
     return on_count, off_count, alpha, excess, signif
 
 # aeff evaluation for source area [cm2]
-def eval_aeff(irf_filename, pnt, source, rad, energies, pixel_size):
-    aeff = EffectiveArea(irf_filename=irf_filename)
+def eval_aeff(irf_filename, pnt, source, rad, energies, pixel_size, cache_dir=None):
+    cache = DiskCache(cache_dir) if cache_dir else None
+    aeff = EffectiveArea(irf_filename=irf_filename, cache=cache)
     region = copy.deepcopy(source)
     region['rad'] = rad
     aeff_val = aeff.weighted_value_for_region(region, pnt, energies, pixel_size)
@@ -62,6 +63,7 @@ if __name__ == '__main__':
     parser.add_argument("-emin", "--energy-min", help="the energy min to eval the Aeff", type=float, default=None)
     parser.add_argument("-emax", "--energy-max", help="the energy max to eval the Aeff", type=float, default=None)
     parser.add_argument("-psize", "--pixel-size", help="the pixel size to count the Aeff", type=float, default=0.05)
+    parser.add_argument("-aeff-cache", "--aeff-cache-dir", help="directory to cache the region Aeff values between runs", default=None)
     parser.add_argument("-time", "--livetime", help="time in seconds. Useful only to get the flux [ph/cm²/sec]", type=float, default=None)
     args = parser.parse_args()
 
@@ -76,7 +78,7 @@ if __name__ == '__main__':
 
     on, off, alpha, excess, significance = counting(args.events_file, pnt_coords, source_coords, args.region_radius)
 
-    source_reg_aeff = eval_aeff(args.irf_file, pnt_coords, source_coords, args.region_radius, [args.energy_min, args.energy_max], args.pixel_size)
+    source_reg_aeff = eval_aeff(args.irf_file, pnt_coords, source_coords, args.region_radius, [args.energy_min, args.energy_max], args.pixel_size, args.aeff_cache_dir)
 
     results = [on, off, alpha, excess, significance, source_reg_aeff]
     if args.livetime is not None:
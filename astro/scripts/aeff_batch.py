@@ -0,0 +1,31 @@
+import argparse
+from lib.batch import evaluate_aeff_batch
+
+# Example:
+# python aeff_batch.py -irf South_z20_0.5h.fits South_z40_0.5h.fits -src 83.6331,22.0145,0.2 -pnt 83.6331,22.5145 84.1331,22.0145 -bands 0.03,1.0 1.0,150.0 -o aeff.tsv
+
+def parse_values(text, n, name):
+    values = [ float(v) for v in text.split(',') ]
+    if len(values) != n:
+        raise Exception('{} needs {} comma separated values'.format(name, n))
+    return values
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="region effective area for irf files x regions x pointings x energy bands")
+    parser.add_argument('-irf', '--irf-files', help='the irf files', nargs='+', required=True)
+    parser.add_argument('-src', '--regions', help='the regions as ra,dec,rad', nargs='+', required=True)
+    parser.add_argument('-pnt', '--pointings', help='the pointings as ra,dec', nargs='+', required=True)
+    parser.add_argument('-bands', '--energy-bands', help='the energy bands in TeV as emin,emax', nargs='+', required=True)
+    parser.add_argument('-psize', '--pixel-size', help="the pixel size to count the Aeff", type=float, default=0.05)
+    parser.add_argument('-index', '--power-law-index', help="power law index for aeff calculation", type=float, default=-2.4)
+    parser.add_argument('-j', '--processes', help='number of worker processes (default: cpu count)', type=int, default=None)
+    parser.add_argument('-o', '--output', help='the output table (.tsv)', default=None)
+    args = parser.parse_args()
+
+    regions = [ dict(zip(['ra', 'dec', 'rad'], parse_values(r, 3, 'region'))) for r in args.regions ]
+    pointings = [ dict(zip(['ra', 'dec'], parse_values(p, 2, 'pointing'))) for p in args.pointings ]
+    bands = [ parse_values(b, 2, 'energy band') for b in args.energy_bands ]
+
+    fmt = '{irf} {ra:8.4f} {dec:8.4f} {rad:5.2f} {pnt_ra:8.4f} {pnt_dec:8.4f} {emin:8.3f} {emax:8.3f} {aeff:12.5e}'
+    for row in evaluate_aeff_batch(args.irf_files, regions, pointings, bands, args.pixel_size, args.power_law_index, args.processes, args.output):
+        print(fmt.format(**row))
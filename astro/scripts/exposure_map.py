@@ -0,0 +1,30 @@
+import argparse
+import numpy as np
+from lib.irf import EffectiveArea
+
+# Example:
+# python exposure_map.py -irf irf_prod3b_v2_South_z20_0.5h.fits -pnt-ra 83.6331 -pnt-dec 22.5145 -livetime 1800 -emin 0.03 -emax 150 -o expcube.fits
+# with --power-law-index the output is a single spectrum weighted image
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="exposure map [cm² s] from the irf effective area")
+    parser.add_argument("-irf", "--irf-file", help="the irf file", required=True)
+    parser.add_argument('-pnt-ra', '--pointing-ra', help='the pointing right ascension', type=float, required=True)
+    parser.add_argument('-pnt-dec', '--pointing-dec', help='the pointing declination', type=float, required=True)
+    parser.add_argument('-livetime', '--livetime', help='the observation livetime [s]', type=float, required=True)
+    parser.add_argument('-emin', '--energy-min', help='the low energy boundary [TeV]', type=float, required=True)
+    parser.add_argument('-emax', '--energy-max', help='the high energy boundary [TeV]', type=float, required=True)
+    parser.add_argument('-ebins', '--energy-bins', help='number of log spaced energy bins (default: 20)', type=int, default=20)
+    parser.add_argument('-binsz', '--pixel-size', help='the pixel size in degree (default: 0.02)', type=float, default=0.02)
+    parser.add_argument('-npix', '--pixels', help='number of pixels per axis (default: 200)', type=int, default=200)
+    parser.add_argument('-index', '--power-law-index', help="power law index to weight the energy bins in a single image", type=float, default=None)
+    parser.add_argument('-o', '--output', help='the output file (.fits)', required=True)
+    args = parser.parse_args()
+
+    pnt = { 'ra': args.pointing_ra, 'dec': args.pointing_dec }
+    energies = np.logspace(np.log10(args.energy_min), np.log10(args.energy_max), args.energy_bins + 1)
+    if args.power_law_index is None:
+        # cube planes at the bins log centers
+        energies = np.sqrt(energies[1:] * energies[:-1])
+    aeff = EffectiveArea(irf_filename=args.irf_file)
+    aeff.exposure_map(pnt, args.livetime, energies, binsz=args.pixel_size, npix=(args.pixels, args.pixels), spectrum=args.power_law_index, filename=args.output, overwrite=True)
@@ -1,5 +1,7 @@
 import argparse
+import numpy as np
 from astropy.io import fits
+from lib.events import EventsFile
 
 def show_header_cards(hdu):
     print('HDU cards:')
@@ -50,13 +52,43 @@ def show_data(hdu):
     print(fmt_v.format('min', *aggr['min']))
     print(fmt_v.format('max', *aggr['max']))
     print(fmt_v.format('mean', *aggr['mean']))
-        
+
+def show_table_data(filename, extension, chunk_size=1000000):
+    """
+    same of show_data for binary tables, the table is memory mapped and
+    aggregated in chunks of rows so big files are not loaded in memory
+    """
+    events_file = EventsFile(filename, extension)
+    if events_file.nrows == 0:
+        print('HDU Data: -')
+        return
+
+    names = events_file.names
+    aggr = { 'min': { n: np.inf for n in names }, 'max': { n: -np.inf for n in names }, 'sum': { n: 0.0 for n in names }, 'size': { n: 0 for n in names } }
+    for chunk in events_file.chunks(names, chunk_size):
+        for n in names:
+            vals = chunk[n]
+            aggr['min'][n] = min(aggr['min'][n], vals.min())
+            aggr['max'][n] = max(aggr['max'][n], vals.max())
+            aggr['sum'][n] += np.sum(vals, dtype=np.float64)
+            aggr['size'][n] += vals.size
+    fmt_s = '{:>10s}: ' + ' {:>10s}' * len(names)
+    fmt_v = '{:>10s}: ' + ' {:>10.2e}' * len(names)
+    print('HDU Data:')
+    print(fmt_s.format('name', *names))
+    print(fmt_v.format('min', *[ aggr['min'][n] for n in names ]))
+    print(fmt_v.format('max', *[ aggr['max'][n] for n in names ]))
+    print(fmt_v.format('mean', *[ aggr['sum'][n] / aggr['size'][n] for n in names ]))
+
 
 def show_hdu(hdu):
     "Show Header Data Unit (HDU)"
     print(f'HDU name: {hdu.name}')
     show_header(hdu)
-    show_data(hdu)
+    if isinstance(hdu, fits.BinTableHDU):
+        show_table_data(args.input_file, hdu.name)
+    else:
+        show_data(hdu)
 
 def main(args):
     hdul = fits.open(args.input_file)
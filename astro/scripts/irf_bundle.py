@@ -0,0 +1,17 @@
+import argparse
+from lib.irf import write_irf_bundle
+
+# Example:
+# python irf_bundle.py $CALDB/data/cta/prod3b-v2/bcf/South_z20_0.5h/irf_file.fits
+# the IRF classes then read irf_file.fits.bundle/ instead of the FITS file
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="convert IRF files in memory-mappable bundles")
+    parser.add_argument('irf_files', nargs='+', help='the irf files (.fits)')
+    parser.add_argument('-o', '--output-dir', help='the bundle directory (default: <irf file>.bundle). Only with one irf file', default=None)
+    args = parser.parse_args()
+
+    if args.output_dir and len(args.irf_files) > 1:
+        raise Exception('the output dir needs a single irf file')
+    for f in args.irf_files:
+        print(write_irf_bundle(f, args.output_dir))
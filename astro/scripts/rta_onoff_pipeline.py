@@ -1,22 +1,43 @@
 import argparse
-from lib.utils import li_ma
+from lib.utils import li_ma, poisson_significance
 from lib.photometry import Photometrics
-from lib.irf import EffectiveArea
+from lib.irf import EffectiveArea, Background
+from lib.cache import DiskCache
 import numpy as np
 import math
+import sys
 
 # Example:
 # python rta_onoff_pipeline.py -v -irf test_00_crab/irf_prod3b_v2_South_z20_0.5h.fits -events test_00_crab/events.fits -src-ra 83.6331 -src-dec 22.0145 -pnt-ra 84.1331 -pnt-dec 22.0145 -rad 0.2 -bkgmethod cross --save-off-regions test_00_crab/reflection_off.reg --livetime 1200 -emin 0.025 -emax 150.0 --power-law-index -2.48
 
-def counting(phm, src, rad, off_regions, e_min=None, e_max=None, t_min=None, t_max=None, draconian=False):
-    on_count = phm.region_counter(src, rad, emin=e_min, emax=e_max, tmin=t_min, tmax=t_max)
-    off_count = 0
-    for r in off_regions:
-        off_count += phm.region_counter(r, r['rad'], emin=e_min, emax=e_max, tmin=t_min, tmax=t_max)
-
-    alpha = 1 / len(off_regions)
-    excess = on_count - alpha * off_count
-    signif = li_ma(on_count, off_count, alpha)
+def counting(phm, src, rad, off_regions, e_min=None, e_max=None, t_min=None, t_max=None, draconian=False, alpha=None, bkg_rate=None, cube=None, labels=None):
+    if cube is not None:
+        # cube built over the on region and the off regions
+        counts = cube.counts(tmin=t_min, tmax=t_max, emin=e_min, emax=e_max)
+    elif labels is not None:
+        # events already labelled with the on region and the off regions
+        counts = labels.counts(tmin=t_min, tmax=t_max, emin=e_min, emax=e_max)
+    else:
+        on_region = { 'ra': src['ra'], 'dec': src['dec'], 'rad': rad }
+        counts = phm.count_regions([on_region] + list(off_regions), emin=e_min, emax=e_max, tmin=t_min, tmax=t_max)
+    on_count = counts[0]
+    if off_regions:
+        off_count = np.sum(counts[1:])
+        if alpha is None:
+            alpha = 1 / len(off_regions)
+        excess = on_count - alpha * off_count
+        signif = li_ma(on_count, off_count, alpha)
+    else:
+        # no off regions: the off count is the background model prediction in the on region
+        if bkg_rate is None:
+            raise Exception('need off regions or a background model rate')
+        off_count = bkg_rate * (t_max - t_min)
+        alpha = 1.0
+        excess = on_count - off_count
+        # unsigned like li_ma: the sign of the excess is in the excess column
+        signif = poisson_significance(on_count, off_count)
+        if signif is not None:
+            signif = abs(signif)
 
     # !!! here we can implement checks
     err_note = None
@@ -27,7 +48,7 @@ def counting(phm, src, rad, off_regions, e_min=None, e_max=None, t_min=None, t_m
 
     return on_count, off_count, alpha, excess, signif, err_note
 
-def find_off_regions(phm, algo, src, pnt, rad, verbose=False, save=None):
+def find_off_regions(phm, algo, src, pnt, rad, verbose=False, save=None, model_fallback=False):
     if not (src['ra'] and src['dec'] and pnt['ra'] and pnt['dec'] and src['rad']):
         raise Exception('need source and pointing coordinates and a region radius to do aperture photometry')
 
@@ -35,7 +56,16 @@ def find_off_regions(phm, algo, src, pnt, rad, verbose=False, save=None):
     if algo == 'cross':
         off_regions = phm.cross_regions(pnt, src, rad)
     elif algo == 'reflection':
-        off_regions = phm.reflected_regions(pnt, src, rad)
+        try:
+            off_regions = phm.reflected_regions(pnt, src, rad)
+        except Exception as e:
+            if not model_fallback:
+                raise
+            # not on stdout, where the results rows go
+            print('{} Using the background model.'.format(e), file=sys.stderr)
+            off_regions = []
+    elif algo == 'model':
+        off_regions = []
     else:
         raise Exception('invalid background regions algorithm')
 
@@ -44,16 +74,32 @@ def find_off_regions(phm, algo, src, pnt, rad, verbose=False, save=None):
         for i, o in enumerate(off_regions):
             print('      off regions #{:02d}:'.format(i), o)
 
-    if save:
+    if save and off_regions:
         phm.write_region(off_regions, save, color='red', dash=True, width=2)
 
     return off_regions
 
+def background_eval(args, src, pnt, off_regions):
+    """returns the acceptance corrected alpha when there are off regions, or
+    the background model rate [counts/s] in the source region when there are not.
+    """
+    if off_regions and not args.acceptance_alpha:
+        return None, None
+    if not (args.irf_file and args.energy_min and args.energy_max):
+        raise Exception('need the irf file and energy min and max to use the background model')
+
+    bkg = Background(irf_filename=args.irf_file)
+    energies = [args.energy_min, args.energy_max]
+    if off_regions:
+        return bkg.alpha(src, off_regions, pnt, energies), None
+    return None, bkg.rate(src, pnt, energies)
+
 def aeff_eval(args, src, pnt):
     if not(args.energy_min and args.energy_max and args.pixel_size and args.power_law_index):
         raise Exception('need energy min and max, a pixel size to eval the flux')
 
-    aeff = EffectiveArea(irf_filename=args.irf_file)
+    cache = DiskCache(args.aeff_cache_dir) if args.aeff_cache_dir else None
+    aeff = EffectiveArea(irf_filename=args.irf_file, cache=cache)
     # these IRFs return value in m², so we need convert
     # the source data struct need a 'rad'
     source_reg_aeff = aeff.weighted_value_for_region(src, pnt, [args.energy_min, args.energy_max], args.pixel_size, args.power_law_index) * 1e4 # cm2
@@ -67,10 +113,11 @@ def main_simple(opts):
     radius = opts.region_radius
     livetime = opts.end_time - opts.begin_time
 
-    off_regions = find_off_regions(phm, opts.background_method, src, pnt, radius, verbose=opts.verbose, save=opts.save_off_regions)
+    off_regions = find_off_regions(phm, opts.background_method, src, pnt, radius, verbose=opts.verbose, save=opts.save_off_regions, model_fallback=bool(opts.irf_file))
+    alpha, bkg_rate = background_eval(opts, src, pnt, off_regions)
 
     # counting
-    on_count, off_count, alpha, excess, significance, err_note = counting(phm, src, radius, off_regions, e_min=opts.energy_min, e_max=opts.energy_max, t_min=opts.begin_time, t_max=opts.end_time, draconian=True)
+    on_count, off_count, alpha, excess, significance, err_note = counting(phm, src, radius, off_regions, e_min=opts.energy_min, e_max=opts.energy_max, t_min=opts.begin_time, t_max=opts.end_time, draconian=True, alpha=alpha, bkg_rate=bkg_rate)
 
     flux = None
     if opts.power_law_index:
@@ -106,9 +153,10 @@ def main_with_time_intervals(opts):
     pnt = { 'ra': opts.pointing_ra, 'dec': opts.pointing_dec }
     radius = opts.region_radius
 
-    off_regions = find_off_regions(phm, opts.background_method, src, pnt, radius, verbose=opts.verbose, save=opts.save_off_regions)
+    off_regions = find_off_regions(phm, opts.background_method, src, pnt, radius, verbose=opts.verbose, save=opts.save_off_regions, model_fallback=bool(opts.irf_file))
+    alpha, bkg_rate = background_eval(opts, src, pnt, off_regions)
 
-    # useful to compute the flux. slow exec
+    # useful to compute the flux
     flux = float('NaN')
     region_eff_resp = float('NaN')
     if opts.power_law_index:
@@ -117,15 +165,25 @@ def main_with_time_intervals(opts):
     # results go in output array
     output = []
 
+    # the events are labelled with the regions once, then every
+    # time step is counted from cumulative counts of the labels
+    on_region = { 'ra': src['ra'], 'dec': src['dec'], 'rad': radius }
+    labels = phm.label_regions([on_region] + list(off_regions))
+    cube = None
+    if opts.step_time and opts.step_time >= 1:
+        time_edges = np.append(np.arange(opts.begin_time, opts.end_time, opts.step_time), opts.end_time)
+        energy_edges = [ e for e in [opts.energy_min, opts.energy_max] if e is not None ]
+        cube = phm.count_cube(labels.regions, time_edges, sorted(energy_edges), labels=labels)
+
     # counter helper
     def counter_fn(t_begin, t_end):
-            on_count, off_count, alpha, excess, significance, err_note = counting(phm, src, radius, off_regions, e_min=opts.energy_min, e_max=opts.energy_max, t_min=t_begin, t_max=t_end, draconian=False)
+            on_count, off_count, alpha_value, excess, significance, err_note = counting(phm, src, radius, off_regions, e_min=opts.energy_min, e_max=opts.energy_max, t_min=t_begin, t_max=t_end, draconian=False, alpha=alpha, bkg_rate=bkg_rate, cube=cube, labels=labels)
 
             livetime = t_end - t_begin
             if not math.isnan(region_eff_resp):
                 flux = excess / region_eff_resp / livetime
 
-            output.append({ 'on': on_count, 'off': off_count, 'alpha': alpha, 'exc': excess, 'sign': significance, 'err_note': err_note, 'flux': flux, 'aeff': region_eff_resp, 'tmin': t_begin, 'tmax': t_end, 'livetime': livetime })
+            output.append({ 'on': on_count, 'off': off_count, 'alpha': alpha_value, 'exc': excess, 'sign': significance, 'err_note': err_note, 'flux': flux, 'aeff': region_eff_resp, 'tmin': t_begin, 'tmax': t_end, 'livetime': livetime })
 
     if opts.step_time:
         if opts.step_time < 1:
@@ -179,12 +237,14 @@ if __name__ == '__main__':
     parser.add_argument('-pnt-ra', '--pointing-ra', help='the pointing right ascension', type=float)
     parser.add_argument('-pnt-dec', '--pointing-dec', help='the pointing declination', type=float)
     parser.add_argument('-rad', '--region-radius', help='the region radius (default: 0.2°)', default=0.2, type=float)
-    parser.add_argument('-bkgmethod', '--background-method', help='choose background regions algorithm. Currently implemented: cross, reflection. (default: cross)', default='cross')
+    parser.add_argument('-bkgmethod', '--background-method', help='choose background regions algorithm. Currently implemented: cross, reflection, model (irf background, no off regions). (default: cross)', default='cross')
+    parser.add_argument('-acc-alpha', '--acceptance-alpha', help='compute alpha from the irf background acceptance of on/off regions', default=False, action='store_true')
     parser.add_argument('-save-off', '--save-off-regions', help='save off regions in .reg file')
     # aeff options
     parser.add_argument('-emin', '--energy-min', help='the low energy boundary to eval the aeff', type=float)
     parser.add_argument('-emax', '--energy-max', help='the high energy boundary to eval the aeff', type=float)
     parser.add_argument('-psize', '--pixel-size', help="the pixel size to count the Aeff", type=float, default=0.05)
+    parser.add_argument('-aeff-cache', '--aeff-cache-dir', help="directory to cache the region Aeff values between runs", default=None)
     parser.add_argument('-tbegin', '--begin-time', help="the observation starting time", type=float, default=0)
     parser.add_argument('-tend',   '--end-time', help="the observation ending duration", type=float)
     parser.add_argument('-tstep',  '--step-time', help="the time interval to split the full observation duration", type=float, default=None)
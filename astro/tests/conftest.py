@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the modules are imported as lib.* (the scripts run with astro in PYTHONPATH)
+# and as astro.lib.* (photometry), so both astro and its parent are in the path
+astro_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.dirname(astro_dir))
+sys.path.insert(0, astro_dir)
@@ -0,0 +1,58 @@
+import multiprocessing as mp
+import numpy as np
+import pytest
+from lib.events import EventStore
+
+def make_store(n=50000):
+    rng = np.random.default_rng(0)
+    return EventStore.from_arrays({ 'TIME': np.sort(rng.uniform(0, 100, n)), 'RA': rng.uniform(0, 360, n), 'DEC': rng.uniform(-90, 90, n) })
+
+def attached_sum(descriptor):
+    store = EventStore.attach(descriptor)
+    total = float(store['RA'].sum())
+    store.close()
+    return total
+
+def test_close_with_live_views():
+    shared = make_store().to_shared()
+    try:
+        sub = shared[10:20000]
+        ra = shared['RA']
+        expected = float(sub['RA'].sum())
+        with pytest.raises(Exception, match='live views'):
+            shared.close()
+        # the failed close keeps the block mapped
+        assert float(sub['RA'].sum()) == expected
+        assert float(shared['RA'][10:20000].sum()) == expected
+        del sub, ra
+        shared.close()
+        assert len(shared) == 0
+    finally:
+        shared.unlink()
+
+@pytest.mark.parametrize('method', [ m for m in ['fork', 'spawn'] if m in mp.get_all_start_methods() ])
+def test_attach_close_in_pool(method):
+    store = make_store()
+    shared = store.to_shared()
+    try:
+        with mp.get_context(method).Pool(2) as pool:
+            totals = pool.map(attached_sum, [shared.descriptor()] * 4)
+        assert totals == pytest.approx([float(store['RA'].sum())] * 4)
+        # the workers closed their mappings, the block is still there
+        assert float(shared['RA'].sum()) == pytest.approx(float(store['RA'].sum()))
+        shared.close()
+    finally:
+        shared.unlink()
+
+def test_close_with_live_derived_views():
+    shared = make_store().to_shared()
+    try:
+        view = shared['RA'][5:100][::2]
+        expected = float(view.sum())
+        with pytest.raises(Exception, match='live views'):
+            shared.close()
+        assert float(view.sum()) == expected
+        del view
+        shared.close()
+    finally:
+        shared.unlink()
@@ -0,0 +1,97 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from astropy.io import fits
+
+from lib import irf as irf_module
+from lib.cache import DiskCache
+from lib.irf import IRF, EffectiveArea, ZenithIRFCube, irf_registry, read_irf_bundle, write_irf_bundle
+
+def table_column(name, values, unit=None):
+    values = np.asarray(values, dtype='f4')
+    dim = '(' + ','.join(str(s) for s in values.shape[::-1]) + ')' if values.ndim > 1 else None
+    return fits.Column(name=name, format='{}E'.format(values.size), unit=unit, dim=dim, array=values[np.newaxis, ...])
+
+def write_irf(filename, aeff_scale, psf_scale):
+    """write an irf with effective area and psf only"""
+    thetas = np.linspace(0, 6, 7)
+    theta_mid = (thetas[1:] + thetas[:-1]) / 2
+    log_energies = np.linspace(-1.9, 2.3, 43)
+    log_energy_mid = (log_energies[1:] + log_energies[:-1]) / 2
+    aeff = aeff_scale * 1e5 * np.exp(-(theta_mid[:, None] / 3)**2) / (1 + np.exp(-(log_energy_mid[None, :] + 1) * 4))
+    aeff_hdu = fits.BinTableHDU.from_columns([
+        table_column('ENERG_LO', 10**log_energies[:-1], 'TeV'), table_column('ENERG_HI', 10**log_energies[1:], 'TeV'),
+        table_column('THETA_LO', thetas[:-1], 'deg'), table_column('THETA_HI', thetas[1:], 'deg'),
+        table_column('EFFAREA', aeff, 'm2') ], name='EFFECTIVE AREA')
+
+    log_energies = np.linspace(-1.9, 3.1, 26)
+    log_energy_mid = (log_energies[1:] + log_energies[:-1]) / 2
+    sigma_1 = psf_scale * (0.05 + 0.1 * np.exp(-log_energy_mid[None, :]) * (1 + theta_mid[:, None] / 6))
+    sigma_2 = 2 * sigma_1
+    ampl_2 = 0.2 * np.ones_like(sigma_1)
+    scale = 1 / (2 * np.pi * (np.deg2rad(sigma_1)**2 + ampl_2 * np.deg2rad(sigma_2)**2))
+    psf_hdu = fits.BinTableHDU.from_columns([
+        table_column('ENERG_LO', 10**log_energies[:-1], 'TeV'), table_column('ENERG_HI', 10**log_energies[1:], 'TeV'),
+        table_column('THETA_LO', thetas[:-1], 'deg'), table_column('THETA_HI', thetas[1:], 'deg'),
+        table_column('SIGMA_1', sigma_1, 'deg'), table_column('AMPL_2', ampl_2), table_column('SIGMA_2', sigma_2, 'deg'),
+        table_column('AMPL_3', np.zeros_like(sigma_1)), table_column('SIGMA_3', np.zeros_like(sigma_1), 'deg'),
+        table_column('SCALE', scale) ], name='POINT SPREAD FUNCTION')
+    fits.HDUList([ fits.PrimaryHDU(), aeff_hdu, psf_hdu ]).writeto(filename)
+
+@pytest.fixture(scope='module')
+def irf_files(tmp_path_factory):
+    path = tmp_path_factory.mktemp('irf')
+    files = [ str(path / 'South_z20_irf.fits'), str(path / 'South_z40_irf.fits') ]
+    write_irf(files[0], aeff_scale=1.0, psf_scale=1.0)
+    write_irf(files[1], aeff_scale=0.7, psf_scale=1.5)
+    return files
+
+REGION = { 'ra': 83.6331, 'dec': 22.0145, 'rad': 0.2 }
+POINTING = { 'ra': 83.6331, 'dec': 22.5145 }
+ENERGIES = [ 0.03, 150.0 ]
+
+def test_zenith_cube_nodes_match_single_irf(irf_files):
+    cube = ZenithIRFCube(irf_files)
+    values = cube.weighted_values_for_zeniths(REGION, POINTING, ENERGIES, [ 20.0, 40.0 ])
+    expected = [ EffectiveArea(irf=irf_registry.get(f)).weighted_value_for_region(REGION, POINTING, ENERGIES) for f in irf_files ]
+    np.testing.assert_allclose(values, expected, rtol=1e-9)
+
+def test_zenith_cube_between_and_outside_nodes(irf_files):
+    cube = ZenithIRFCube(irf_files)
+    values = cube.weighted_values_for_zeniths(REGION, POINTING, ENERGIES, [ 10.0, 20.0, 30.0, 40.0, 60.0 ])
+    assert values[0] == pytest.approx(values[1])
+    assert values[3] < values[2] < values[1]
+    assert values[4] == pytest.approx(values[3])
+
+def test_weighted_value_cache_key_has_version(irf_files, tmp_path, monkeypatch):
+    cache = DiskCache(str(tmp_path / 'cache'))
+    aeff = EffectiveArea(irf=irf_registry.get(irf_files[0]), cache=cache)
+    value = aeff.weighted_value_for_region(REGION, POINTING, ENERGIES)
+    # a stale entry is used until the version changes
+    for entry in (tmp_path / 'cache').glob('*.json'):
+        entry.write_text('1.0')
+    assert aeff.weighted_value_for_region(REGION, POINTING, ENERGIES) == 1.0
+    monkeypatch.setattr(irf_module, 'WEIGHTED_AEFF_CACHE_VERSION', irf_module.WEIGHTED_AEFF_CACHE_VERSION + 1)
+    assert aeff.weighted_value_for_region(REGION, POINTING, ENERGIES) == pytest.approx(value)
+
+def test_bundle_reads_the_fits_file_lazily(tmp_path):
+    filename = str(tmp_path / 'irf.fits')
+    write_irf(filename, aeff_scale=1.0, psf_scale=1.0)
+    write_irf_bundle(filename)
+    irf = IRF(filename)
+    assert irf.bundle_tables is not None and irf._hdul is None
+    np.testing.assert_array_equal(irf.get_eff_area().data.field('EFFAREA'), irf.hdul['EFFECTIVE AREA'].data.field('EFFAREA'))
+
+def test_incomplete_bundle_falls_back_to_fits(tmp_path):
+    filename = str(tmp_path / 'irf.fits')
+    write_irf(filename, aeff_scale=1.0, psf_scale=1.0)
+    bundle_dir = write_irf_bundle(filename)
+    with open(os.path.join(bundle_dir, 'manifest.json')) as fh:
+        manifest = json.load(fh)
+    os.remove(os.path.join(bundle_dir, manifest['extensions']['EFFECTIVE AREA']['EFFAREA']))
+    assert read_irf_bundle(filename) is None
+    irf = IRF(filename)
+    assert irf.bundle_tables is None
+    assert irf.get_eff_area().data.field('EFFAREA').shape == irf.hdul['EFFECTIVE AREA'].data.field('EFFAREA').shape
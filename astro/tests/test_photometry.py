@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('regions')
+from astro.lib.photometry import Photometrics
+
+@pytest.fixture(scope='module')
+def phm():
+    rng = np.random.default_rng(0)
+    n = 20000
+    events = np.rec.fromarrays([ rng.uniform(83.0, 84.2, n), rng.uniform(21.5, 22.5, n), 10**rng.uniform(-1.5, 1.5, n), rng.uniform(0, 1000, n) ], names='RA,DEC,ENERGY,TIME')
+    return Photometrics({ 'events_list': events })
+
+@pytest.fixture(scope='module')
+def regions(phm):
+    src = { 'ra': 83.6331, 'dec': 22.0145, 'rad': 0.2 }
+    return [src] + phm.cross_regions({ 'ra': 83.6331, 'dec': 22.2645 }, src, 0.2)
+
+TIME_EDGES = np.linspace(0, 1000, 11)
+ENERGY_EDGES = [ 0.1, 1.0, 10.0 ]
+
+@pytest.mark.parametrize('tmin,tmax,emin,emax', [
+    (None, None, None, None),
+    (100, 500, 0.1, 10.0),
+    (200, 200, None, 1.0),
+    (None, 300, 1.0, None),
+    # off the edges
+    (123.4, 456.7, 0.3, 5.0),
+    # reversed and empty windows
+    (500, 100, None, None),
+    (None, None, 10.0, 0.1),
+    (600, 300, 1.0, 0.1),
+    (1001, None, None, None),
+])
+def test_count_cube_matches_count_regions(phm, regions, tmin, tmax, emin, emax):
+    expected = phm.count_regions(regions, emin=emin, emax=emax, tmin=tmin, tmax=tmax)
+    cube = phm.count_cube(regions, TIME_EDGES, ENERGY_EDGES)
+    labels = phm.label_regions(regions)
+    labelled_cube = phm.count_cube(None, TIME_EDGES, ENERGY_EDGES, labels=labels)
+    for counts in [ cube.counts(tmin, tmax, emin, emax), labels.counts(tmin, tmax, emin, emax), labelled_cube.counts(tmin, tmax, emin, emax) ]:
+        np.testing.assert_array_equal(counts, expected)
@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+from lib.spectrum import PowerLaw, get_spectrum
+
+@pytest.mark.parametrize('index', [ -2.4, -2, np.float32(-2.4), np.float64(-2.4), np.int64(-2) ])
+def test_get_spectrum_index(index):
+    spec = get_spectrum(index)
+    assert isinstance(spec, PowerLaw)
+    edges = [ 0.1, 1.0, 10.0 ]
+    np.testing.assert_allclose(spec.integral(edges), PowerLaw(float(index)).integral(edges))
+
+@pytest.mark.parametrize('value', [ True, np.bool_(False), None, [ -2.4 ] ])
+def test_get_spectrum_invalid(value):
+    with pytest.raises(Exception, match='power law index'):
+        get_spectrum(value)